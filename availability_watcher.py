@@ -0,0 +1,265 @@
+"""
+Lightweight watcher that starts a booking as soon as tomorrow's visit round opens.
+
+Usage:
+    AVAILABILITY_URL=... uv run python availability_watcher.py     # standalone: launches main.py itself
+    AVAILABILITY_WATCH=1 AVAILABILITY_URL=... uv run python telegram_listener.py   # inside the listener
+
+What it does:
+- Fetches AVAILABILITY_URL over plain HTTP with `requests`, no browser, and reads the
+  `#dd` (day) and `#round` <select> options from the HTML. A JSON endpoint returning
+  {"days": [...], "rounds": [...]} works as well. AVAILABILITY_URL is required: the
+  booking landing page only shows these selects after the session-based form steps,
+  so it cannot be used here. A page without either select is reported loudly.
+- Uses conditional GETs (ETag / Last-Modified) and a content fingerprint so unchanged
+  responses are cheap and only real changes are acted on.
+- Polls every few seconds around the expected release times (WATCH_RELEASE_TIMES,
+  default 09:30) and backs off exponentially, up to WATCH_MAX_INTERVAL_SEC, otherwise.
+- When tomorrow's day (and the wanted round, if the page lists rounds) appears, hands
+  off to the booking engine. Only a hand-off that finds a booking for the round started
+  (now, or earlier today by /start or the queue) sends the Telegram alert and marks the
+  day/round as done; a declined one (a booking for another round still running) is
+  retried every WATCH_BASE_INTERVAL_SEC.
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from html.parser import HTMLParser
+
+import requests
+from config import TELEGRAM_RATE_SHARE, TELEGRAM_RUN_SHARE
+from telegram_helper import PRIORITY_ALERT, get_dispatcher, send_telegram_message
+
+# A page or endpoint that shows the #dd/#round selects (or JSON) without a session
+AVAILABILITY_URL = os.getenv("AVAILABILITY_URL") or ""
+WATCH_ROUND = os.getenv("WATCH_ROUND") or "2"  # same default round as main.py
+WATCH_RELEASE_TIMES = os.getenv("WATCH_RELEASE_TIMES") or "09:30"
+WATCH_FAST_INTERVAL_SEC = float(os.getenv("WATCH_FAST_INTERVAL_SEC") or 2)
+WATCH_BASE_INTERVAL_SEC = float(os.getenv("WATCH_BASE_INTERVAL_SEC") or 30)
+WATCH_MAX_INTERVAL_SEC = float(os.getenv("WATCH_MAX_INTERVAL_SEC") or 600)
+# Poll fast from this long before a release time until this long after it
+WATCH_WINDOW_BEFORE_SEC = 5 * 60
+WATCH_WINDOW_AFTER_SEC = 10 * 60
+
+
+class _SelectOptionsParser(HTMLParser):
+    """Collect enabled <option> values of the <select> elements we care about."""
+
+    def __init__(self, select_ids):
+        super().__init__()
+        self.select_ids = set(select_ids)
+        self.options = {sid: [] for sid in select_ids}
+        self._current = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "select":
+            sid = attrs.get("id") or attrs.get("name")
+            self._current = sid if sid in self.select_ids else None
+        elif tag == "option" and self._current and "disabled" not in attrs:
+            value = (attrs.get("value") or "").strip()
+            if value:
+                self.options[self._current].append(value)
+
+    def handle_endtag(self, tag):
+        if tag == "select":
+            self._current = None
+
+
+def parse_availability(body, content_type=""):
+    """Return {"days": [...], "rounds": [...]} from an HTML page or JSON document."""
+    if "json" in content_type or body.lstrip().startswith("{"):
+        data = json.loads(body)
+        return {"days": [str(d) for d in data.get("days", [])],
+                "rounds": [str(r) for r in data.get("rounds", [])]}
+    parser = _SelectOptionsParser(("dd", "round"))
+    parser.feed(body)
+    return {"days": parser.options["dd"], "rounds": parser.options["round"]}
+
+
+def parse_release_times(spec):
+    times = []
+    for part in spec.split(","):
+        part = part.strip()
+        if part:
+            hour, _, minute = part.partition(":")
+            times.append((int(hour), int(minute or 0)))
+    return times
+
+
+class AvailabilityWatcher:
+    """
+    Poll the booking site and call `on_available(round_choice, snapshot)` when the
+    wanted slot for tomorrow appears. `on_available` should return quickly, with True
+    if a booking for the slot has started (by it or earlier) and False if it declined
+    (the hand-off is retried later).
+    """
+
+    def __init__(self, on_available, url=AVAILABILITY_URL, wanted_round=WATCH_ROUND,
+                 release_times=WATCH_RELEASE_TIMES, fast_interval=WATCH_FAST_INTERVAL_SEC,
+                 base_interval=WATCH_BASE_INTERVAL_SEC, max_interval=WATCH_MAX_INTERVAL_SEC,
+                 session=None, now=datetime.now):
+        if not url:
+            raise ValueError(
+                "AVAILABILITY_URL is not set; the booking landing page does not show the "
+                "#dd/#round selects, so there is nothing to watch")
+        self.on_available = on_available
+        self.url = url
+        self.wanted_round = str(wanted_round) if wanted_round else None
+        self.release_times = parse_release_times(release_times)
+        self.fast_interval = fast_interval
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.session = session or requests.Session()
+        self._now = now
+        self._validators = {}
+        self._fingerprint = None
+        self._snapshot = None
+        self._fired = set()
+        self._declined = {}  # slot key -> monotonic time the hand-off was last declined
+        self._idle_interval = base_interval
+        self.probes = 0
+        self.changes = 0
+
+    # -- probing -----------------------------------------------------------
+
+    def probe(self):
+        """Fetch the page; return a snapshot dict, or None when unchanged."""
+        self.probes += 1
+        resp = self.session.get(self.url, headers=self._validators, timeout=10)
+        if resp.status_code == 304:
+            return None
+        resp.raise_for_status()
+        validators = {}
+        if resp.headers.get("ETag"):
+            validators["If-None-Match"] = resp.headers["ETag"]
+        if resp.headers.get("Last-Modified"):
+            validators["If-Modified-Since"] = resp.headers["Last-Modified"]
+        self._validators = validators
+
+        snapshot = parse_availability(
+            resp.text, resp.headers.get("Content-Type", ""))
+        fingerprint = hashlib.sha1(json.dumps(
+            snapshot, sort_keys=True).encode("utf-8")).hexdigest()
+        if fingerprint == self._fingerprint:
+            return None
+        self._fingerprint = fingerprint
+        self._snapshot = snapshot
+        self.changes += 1
+        if not snapshot["days"] and not snapshot["rounds"]:
+            print(f"WARNING: no #dd/#round options found at {self.url}; "
+                  "check AVAILABILITY_URL, the watcher cannot see availability there.")
+        return snapshot
+
+    def wanted_slot(self, snapshot):
+        """(day, round) wanted for tomorrow if the snapshot offers it, else None."""
+        day = str((self._now() + timedelta(days=1)).day)
+        if day not in snapshot["days"]:
+            return None
+        rounds = snapshot["rounds"]
+        if rounds and self.wanted_round and self.wanted_round not in rounds:
+            return None
+        return day, self.wanted_round
+
+    def check_once(self):
+        """Probe once and trigger the hand-off if a wanted slot is open and not yet booked."""
+        changed = self.probe()
+        if changed is not None:
+            print(f"Availability changed: days={changed['days']} rounds={changed['rounds']}")
+        # An unchanged page still counts: a declined hand-off is retried on it
+        snapshot = changed or self._snapshot
+        if snapshot is None:
+            return False
+        slot = self.wanted_slot(snapshot)
+        if slot is None:
+            return False
+        key = (self._now().date().isoformat(),) + slot
+        if key in self._fired:
+            return False
+        declined_at = self._declined.get(key)
+        if declined_at is not None and time.monotonic() - declined_at < self.base_interval:
+            return False
+        day, round_choice = slot
+        if not self.on_available(round_choice, snapshot):
+            self._declined[key] = time.monotonic()
+            return False
+        self._fired.add(key)
+        self._declined.pop(key, None)
+        send_telegram_message(
+            f"🟢 <b>Visit slot open</b>\nDay {day}, round {round_choice or 'default'} is available — booking started.",
+            priority=PRIORITY_ALERT, wait=False)
+        return True
+
+    # -- scheduling --------------------------------------------------------
+
+    def seconds_to_window(self, now=None):
+        """0 inside a fast-poll window, else seconds until the next one opens."""
+        now = now or self._now()
+        best = None
+        for day_offset in (0, 1):
+            for hour, minute in self.release_times:
+                release = (now + timedelta(days=day_offset)).replace(
+                    hour=hour, minute=minute, second=0, microsecond=0)
+                start = release - timedelta(seconds=WATCH_WINDOW_BEFORE_SEC)
+                end = release + timedelta(seconds=WATCH_WINDOW_AFTER_SEC)
+                if start <= now <= end:
+                    return 0.0
+                if now < start:
+                    wait = (start - now).total_seconds()
+                    best = wait if best is None else min(best, wait)
+        return best if best is not None else self.max_interval
+
+    def next_interval(self, changed):
+        """Tight near release times; otherwise back off while nothing changes."""
+        to_window = self.seconds_to_window()
+        if to_window <= 0:
+            self._idle_interval = self.base_interval
+            return self.fast_interval
+        if changed:
+            self._idle_interval = self.base_interval
+        else:
+            self._idle_interval = min(self._idle_interval * 2, self.max_interval)
+        # never sleep through the start of a fast-poll window
+        return max(self.fast_interval, min(self._idle_interval, to_window))
+
+    def run(self, stop_event=None):
+        stop_event = stop_event or threading.Event()
+        print(f"Availability watcher polling {self.url}")
+        while not stop_event.is_set():
+            changes_before = self.changes
+            try:
+                self.check_once()
+            except requests.exceptions.RequestException as e:
+                print(f"Availability probe failed: {e}")
+            except Exception as e:
+                print(f"Availability watcher error: {e}")
+            stop_event.wait(self.next_interval(self.changes != changes_before))
+
+
+def _launch_main(round_choice, snapshot):
+    cmd = [sys.executable or "python", "main.py"]
+    if round_choice:
+        cmd.append(str(round_choice))
+    print(f"Starting automation using: {' '.join(cmd)}")
+    subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return True
+
+
+if __name__ == "__main__":
+    # Like the listener, leave TELEGRAM_RUN_SHARE of the send limits to main.py
+    get_dispatcher(TELEGRAM_RATE_SHARE * (1 - TELEGRAM_RUN_SHARE))
+    try:
+        watcher = AvailabilityWatcher(_launch_main)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(2)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
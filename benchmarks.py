@@ -0,0 +1,446 @@
+"""
+Benchmarks for the hot paths, with stored baselines and regression budgets.
+
+Usage:
+    python benchmarks.py                     # run, compare with bench_baseline.json, exit 1 on regression
+    python benchmarks.py --update-baseline   # run and store the results as the new baseline
+    python benchmarks.py --only format,dispatch --no-e2e
+    python benchmarks.py --runs 5            # median of 5 runs per metric (default 3)
+
+What it measures (all metrics are "lower is better"):
+- format_*: building the dialog alert / status message text (telegram_helper).
+- dispatch_*: telegram_listener.handle_update for common commands and for commands dropped
+  by the per-chat limit. Replies are discarded and the pending queue and coordination
+  store are held in memory, so this times the command handling, not the disk or the
+  sender threads.
+- scheduler_tick_*: one process_pending_runs_once() over a large pending_runs.json.
+- notifier_fanout_*: TelegramDispatcher delivering to many chats against fake_telegram_api.
+- e2e_booking_*: main.main() against fake_visit_site, fresh, with a restored session and
+  in LOW_MEMORY mode, with the peak RSS of the whole process tree for each
+  (skipped when Playwright / Chromium are not installed).
+
+Everything runs offline. bench_baseline.json holds the baseline numbers and the budgets:
+"budget" is the default allowed slowdown (0.30 = 30 %), "budgets" overrides it per metric.
+Baselines are machine specific; refresh them with --update-baseline on the machine that runs
+the check (on a new machine, clear its "metrics" first). Every metric is the median of --runs runs
+(the browser benchmark runs once). A fixed reference workload is timed around every run and
+the CPU-bound metrics are reported at the machine speed stored with the baseline
+(host_reference_us), so a check that lands in a slow spell of a shared machine is not
+flagged for it. Budgets are set above the spread that leaves on an unchanged tree.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import timeit
+from contextlib import contextmanager
+from datetime import datetime
+
+from fake_telegram_api import FakeTelegramAPI
+from fake_visit_site import FakeVisitSite
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+DEFAULT_BUDGET = 0.30
+HOST_METRIC = "host_reference_us"  # machine speed the baseline was recorded at
+
+BENCH_CHAT_ID = "1000"
+
+
+def calibrate(fn, min_time=0.05):
+    """Number of calls of `fn` that take at least `min_time` seconds."""
+    timer = timeit.Timer(fn)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    return number
+
+
+def measure(fn, number=None, repeat=5):
+    """
+    Best-of-`repeat` seconds per call of `fn` over `number` calls, with garbage collection
+    off as in timeit. Without `number`, see calibrate().
+    """
+    if number is None:
+        number = calibrate(fn)
+    return min(timeit.Timer(fn).repeat(repeat, number)) / number
+
+
+def measure_rounds(cases, rounds=7):
+    """
+    Best seconds per call for each (name, fn, prepare) case; `prepare` (or None) runs
+    before every timing. Rounds go through every case in turn, so a slow spell on the
+    machine costs each case one round at most rather than all of them.
+    """
+    numbers = {}
+    for name, fn, prepare in cases:
+        if prepare:
+            prepare()
+        numbers[name] = calibrate(fn)
+    best = {}
+    for _ in range(rounds):
+        for name, fn, prepare in cases:
+            if prepare:
+                prepare()
+            per_call = measure(fn, numbers[name], repeat=1)
+            best[name] = min(best.get(name, per_call), per_call)
+    return best
+
+
+_REFERENCE_DATA = [{"id": i, "chat_id": str(1000 + i), "text": f"message {i}"} for i in range(50)]
+
+
+def _reference_workload():
+    """Fixed pure-Python work (dicts, strings, JSON) to gauge the machine's current speed."""
+    by_chat = {}
+    for item in _REFERENCE_DATA:
+        by_chat.setdefault(item["chat_id"], []).append(item["text"].upper())
+    return json.dumps(sorted(by_chat.items(), reverse=True))
+
+
+def measure_host(number=None):
+    """Seconds per call of the reference workload, right now."""
+    return measure(_reference_workload, number, repeat=3)
+
+
+class _FinishedProc:
+    """Stands in for a Popen whose automation has already exited."""
+    pid = 0
+
+    def poll(self):
+        return 0
+
+
+class _RunningProc(_FinishedProc):
+    def poll(self):
+        return None
+
+
+class _MemoryStore:
+    """The part of coordination.FileLeaseStore that commands use, without the disk."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def mutex(self, name, timeout=10.0):
+        with self._lock:
+            yield
+
+
+# -- benchmarks -----------------------------------------------------------------
+# Each returns {metric_name: value}; names carry their unit.
+
+def bench_format(env):
+    from telegram_helper import format_automation_status, format_dialog_alert
+    ts = datetime(2025, 8, 31, 9, 30)
+    best = measure_rounds([
+        ("format_dialog_alert_us",
+         lambda: format_dialog_alert("alert", "รอบนี้เต็มแล้ว กรุณาเลือกรอบอื่น", ts), None),
+        ("format_automation_status_us",
+         lambda: format_automation_status("Completed", "VisitBRP automation finished successfully", 2, ts),
+         None),
+    ])
+    return {name: value * 1e6 for name, value in best.items()}
+
+
+def bench_dispatch(env):
+    import telegram_listener as tl
+    from rate_limit import TokenBucket
+    tl.SCHEDULE_HOUR, tl.SCHEDULE_MINUTE = 0, 0  # every /start is an immediate start
+    tl.current_proc = _RunningProc()             # ... which hits "already running"
+
+    pending = []
+    saved = {name: getattr(tl, name) for name in
+             ("send_ack", "load_pending_runs", "save_pending_runs", "coord_store")}
+    tl.send_ack = lambda text, chat_id=None: True
+    tl.load_pending_runs = lambda: list(pending)
+    tl.save_pending_runs = lambda runs: pending.__setitem__(slice(None), runs)
+    tl.coord_store = _MemoryStore()
+
+    def update(text):
+        return {"update_id": 1, "message": {"chat": {"id": int(BENCH_CHAT_ID)}, "text": text}}
+
+    # Fresh budgets before each command so this times the command, not the limiter
+    def unlimited():
+        tl._chat_buckets.clear()
+        tl.command_global_bucket = TokenBucket(1e9, 1e9)
+        tl.COMMAND_CHAT_RATE = tl.COMMAND_CHAT_BURST = 1e9
+
+    # A chat flooding /start: after the burst every command is dropped by its bucket
+    def flooding():
+        tl._chat_buckets.clear()
+        tl.COMMAND_CHAT_RATE, tl.COMMAND_CHAT_BURST = 0.5, 5
+        for _ in range(10):
+            tl.handle_update(update("/start 2"))
+
+    def handle(text):
+        u = update(text)
+        return lambda: tl.handle_update(u)
+
+    cases = [(f"dispatch_{name}_us", handle(text), unlimited) for name, text in (
+        ("status", "/status"), ("start", "/start 2"), ("pending", "/pending"),
+        ("cancel", "/cancel 99"), ("text", "hello"))]
+    cases.append(("dispatch_throttled_us", handle("/start 2"), flooding))
+
+    try:
+        results = {name: value * 1e6 for name, value in measure_rounds(cases).items()}
+    finally:
+        for name, value in saved.items():
+            setattr(tl, name, value)
+    return results
+
+
+def bench_scheduler(env, sizes=(100, 2000)):
+    import telegram_listener as tl
+    tl.SCHEDULE_HOUR, tl.SCHEDULE_MINUTE = 0, 0
+    tl.start_automation_subprocess = lambda round_arg=None: _FinishedProc()
+    from coordination import FileLeaseStore
+    saved = {name: getattr(tl, name) for name in ("send_telegram_message", "coord_store")}
+    tl.send_telegram_message = lambda text, **kwargs: True
+    # Each run on an empty store: claims left by earlier runs would slow every tick
+    tl.coord_store = FileLeaseStore(tempfile.mkdtemp(dir=env["coord_dir"]))
+    today = datetime.now().date().isoformat()
+
+    def tick():
+        tl.process_pending_runs_once()
+        # Every job books the same round: free the day's slot so each tick launches
+        # one instead of skipping it as already booked
+        tl.coord_store.release_claim(tl.slot_key("2"))
+
+    results = {}
+    try:
+        for size in sizes:
+            tl.current_proc = None
+            jobs = [{"id": f"bench-{size}-{i}-{time.time_ns()}", "chat_id": BENCH_CHAT_ID,
+                     "round": "2", "requested_at": datetime.now().isoformat(),
+                     "scheduled_for": today} for i in range(size + 100)]
+            tl.save_pending_runs(jobs)
+            # each tick launches (and claims) one job; the queue stays ~`size` long
+            results[f"scheduler_tick_{size}_ms"] = measure(tick, 20, repeat=5) * 1e3
+        tl.save_pending_runs([])
+    finally:
+        for name, value in saved.items():
+            setattr(tl, name, value)
+    return results
+
+
+def bench_notifier(env, chats=20, messages=25):
+    from telegram_helper import TelegramDispatcher
+    api = FakeTelegramAPI(enforce_limits=False).start()
+    try:
+        # Limits lifted so this measures our overhead, not Telegram's pacing
+        dispatcher = TelegramDispatcher(f"{api.base_url}/botBENCH/sendMessage",
+                                        global_rate=1e6, global_burst=1e6, chat_rate=1e6)
+        chat_ids = [str(2000 + i) for i in range(chats)]
+
+        def fan_out():
+            deliveries = [dispatcher.submit(chat_ids, f"bench message {i}") for i in range(messages)]
+            for d in deliveries:
+                d.wait(30)
+
+        per_round = measure(fan_out, 1, repeat=3)
+        return {f"notifier_fanout_{chats}x{messages}_ms_per_msg":
+                per_round / (chats * messages) * 1e3}
+    finally:
+        api.stop()
+
+
+def bench_e2e(env):
+    try:
+        from playwright.sync_api import Error as PlaywrightError, sync_playwright
+    except ImportError:
+        print("  e2e: Playwright not installed, skipping", file=sys.stderr)
+        return {}
+    try:
+        with sync_playwright() as p:
+            p.chromium.launch(args=["--no-sandbox"]).close()
+    except PlaywrightError as e:
+        print(f"  e2e: Chromium cannot be launched, skipping ({str(e).splitlines()[0]})",
+              file=sys.stderr)
+        return {}
+    os.environ.setdefault("ID_CARD1", "1111111111111")
+    os.environ.setdefault("ID_CARD2", "2222222222222")
+    os.environ.setdefault("MOBILE", "0800000000")
+    os.environ["HEADLESS"] = "1"
+    import main  # reads the IDs above at import
+    from process_memory import PeakRssSampler
+    site = FakeVisitSite().start()
+    try:
+        main.VISIT_URL = site.base_url
+        main.PERSIST_SESSION = True  # "restored" needs the saved profile
+        results = {}
+        # restored: the profile saved by "fresh" resumes at the visitor step
+        for name, low_memory in (("fresh", False), ("restored", False), ("low_memory", True)):
+            main.LOW_MEMORY = low_memory
+            with PeakRssSampler() as sampler:
+                t0 = time.perf_counter()
+                main.main("2")
+                results[f"e2e_booking_{name}_s"] = time.perf_counter() - t0
+            if sampler.samples:
+                results[f"e2e_booking_{name}_peak_rss_mb"] = sampler.peak_bytes / (1024 * 1024)
+        if len(site.bookings) != 3:
+            raise RuntimeError(f"expected 3 bookings on the fake site, got {len(site.bookings)}")
+        return results
+    finally:
+        main.LOW_MEMORY = False
+        site.stop()
+
+
+BENCHMARKS = {
+    "format": bench_format,
+    "dispatch": bench_dispatch,
+    "scheduler": bench_scheduler,
+    "notifier": bench_notifier,
+    "e2e": bench_e2e,
+}
+
+
+# -- harness --------------------------------------------------------------------
+
+def setup_environment():
+    """Point every project module at local fakes before they are imported."""
+    workdir = tempfile.mkdtemp(prefix="visit-bench-")
+    # The scheduler benchmark rewrites pending_runs.json every tick; keep the queue and
+    # claims in memory-backed storage where there is one, so disk latency is not timed
+    coord_dir = tempfile.mkdtemp(prefix="visit-bench-coord-",
+                                 dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    api = FakeTelegramAPI(enforce_limits=False).start()
+    os.environ["TELEGRAM_API_BASE"] = api.base_url
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "BENCH")
+    os.environ["TELEGRAM_CHAT_IDS"] = BENCH_CHAT_ID
+    os.environ["COORD_DIR"] = coord_dir
+    os.environ["BROWSER_PROFILES_DIR"] = os.path.join(workdir, "profiles")
+    return {"workdir": workdir, "coord_dir": coord_dir, "api": api}
+
+
+def load_baseline(path):
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {"budget": DEFAULT_BUDGET, "budgets": {}, "metrics": {}}
+
+
+def compare(results, baseline):
+    """Return (rows, regressions); a row is (metric, value, base, change, budget, status)."""
+    rows, regressions = [], []
+    default_budget = baseline.get("budget", DEFAULT_BUDGET)
+    for metric, value in sorted(results.items()):
+        base = baseline.get("metrics", {}).get(metric)
+        budget = baseline.get("budgets", {}).get(metric, default_budget)
+        if base is None or base <= 0:
+            rows.append((metric, value, base, None, budget, "no baseline"))
+            continue
+        change = value / base - 1.0
+        status = "ok"
+        if change > budget:
+            status = "REGRESSION"
+            regressions.append(metric)
+        rows.append((metric, value, base, change, budget, status))
+    return rows, regressions
+
+
+def print_rows(rows):
+    print(f"{'metric':<42} {'value':>12} {'baseline':>12} {'change':>8} {'budget':>7}  status")
+    for metric, value, base, change, budget, status in rows:
+        base_s = f"{base:.3f}" if base is not None else "-"
+        change_s = f"{change:+.0%}" if change is not None else "-"
+        print(f"{metric:<42} {value:>12.3f} {base_s:>12} {change_s:>8} {budget:>7.0%}  {status}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run benchmarks and check regression budgets.")
+    parser.add_argument("--only", help="comma-separated subset of: " + ", ".join(BENCHMARKS))
+    parser.add_argument("--no-e2e", action="store_true", help="skip the browser benchmark")
+    parser.add_argument("--runs", type=int, default=3,
+                        help="run each benchmark this many times and keep the median")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="store the results as the new baseline instead of checking")
+    args = parser.parse_args(argv)
+
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    if args.no_e2e and "e2e" in names:
+        names.remove("e2e")
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    baseline = load_baseline(args.baseline)
+    env = setup_environment()
+    samples, host_samples, raw_metrics = {}, [], set()
+    host_number = calibrate(_reference_workload)
+    try:
+        # Run after run through every benchmark, so a slow spell on the machine lands in
+        # one sample of each metric (which the median drops), not in all of them
+        for run in range(max(1, args.runs)):
+            for name in names:
+                if name == "e2e" and run:
+                    continue  # minutes per run; once is enough
+                print(f"Running {name} (run {run + 1})...")
+                # Project modules print every reply they queue; keep the report readable
+                stdout, sys.stdout = sys.stdout, open(os.devnull, "w", encoding="utf-8")
+                try:
+                    host = measure_host(host_number)
+                    values = BENCHMARKS[name](env)
+                    host = min(host, measure_host(host_number))
+                finally:
+                    sys.stdout.close()
+                    sys.stdout = stdout
+                host_samples.append(host)
+                if name == "e2e":
+                    # Mostly waiting on the browser, and memory: not CPU-bound
+                    raw_metrics.update(values)
+                for metric, value in values.items():
+                    samples.setdefault(metric, []).append(
+                        value if metric in raw_metrics else value / host)
+    finally:
+        env["api"].stop()
+        shutil.rmtree(env["coord_dir"], ignore_errors=True)  # may be holding memory
+
+    # Report CPU-bound metrics at the speed the machine had when the baseline was
+    # recorded, so a check that lands in a slow spell is not flagged for it
+    host_now = statistics.median(host_samples) * 1e6
+    host_base = baseline.get("metrics", {}).get(HOST_METRIC) or round(host_now, 4)
+    results = {metric: statistics.median(values) * (1 if metric in raw_metrics else host_base / 1e6)
+               for metric, values in samples.items()}
+    print(f"\nMachine speed: reference workload {host_now:.3f} us "
+          f"(baseline {host_base:.3f} us, {host_now / host_base - 1:+.0%})")
+
+    if args.update_baseline:
+        baseline.setdefault("budget", DEFAULT_BUDGET)
+        baseline.setdefault("budgets", {})
+        baseline.setdefault("metrics", {}).update(
+            {k: round(v, 4) for k, v in results.items()})
+        baseline["metrics"].setdefault(HOST_METRIC, host_base)
+        with open(args.baseline, "w", encoding="utf-8") as fh:
+            json.dump(baseline, fh, indent=2, sort_keys=True)
+            fh.write("\n")
+        print(f"Baseline updated: {args.baseline}")
+        print_rows(compare(results, baseline)[0])
+        return 0
+
+    rows, regressions = compare(results, baseline)
+    print_rows(rows)
+    # Budgets are only enforced against a recorded baseline; say so instead of passing quietly
+    unchecked = sorted(m for m in baseline.get("budgets", {})
+                       if m not in baseline.get("metrics", {}))
+    if unchecked:
+        print(f"\nWARNING: {len(unchecked)} budgeted metric(s) have no baseline and are not "
+              f"checked: {', '.join(unchecked)}. Record them with --update-baseline on a "
+              "machine that can run them.")
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) over budget: {', '.join(regressions)}")
+        return 1
+    print("\nAll checked metrics within budget.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+Per-profile persistent browser data for main.py.
+
+Each visitor profile (by default derived from ID_CARD1/ID_CARD2) gets its own Chromium
+user-data directory under `browser_profiles/`, which keeps cookies, local storage and
+the HTTP cache between runs. A small marker file is written only after a successful
+booking and removed again when the next run starts with the profile, so a directory
+without a valid marker (a run that crashed, failed or was stopped) is wiped before use
+and every run starts either from a known-good session or from scratch.
+
+Only one run can use a profile at a time: acquire() takes an exclusive lock file next
+to it (released by release(), or ignored once its process is gone). main.py falls back
+to a non-persistent browser when another run holds the lock.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import socket
+import time
+import uuid
+
+PROFILES_DIR = os.getenv("BROWSER_PROFILES_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "browser_profiles")
+# Saved sessions older than this are not trusted (the site's PHP session will be gone)
+PROFILE_MAX_AGE_SEC = float(os.getenv("PROFILE_MAX_AGE_SEC") or 7 * 24 * 3600)
+# Where the owner's liveness cannot be checked (Windows), a lock this old is stale
+PROFILE_LOCK_STALE_SEC = 2 * 3600
+
+
+def default_profile_name(*ids):
+    """Stable, non-identifying directory name for a set of visitor IDs."""
+    digest = hashlib.sha1("|".join(i or "" for i in ids).encode("utf-8")).hexdigest()
+    return f"profile-{digest[:12]}"
+
+
+class BrowserProfile:
+    def __init__(self, name, root=PROFILES_DIR, max_age=PROFILE_MAX_AGE_SEC):
+        self.name = name
+        self.user_data_dir = os.path.join(root, name)
+        self.marker_path = os.path.join(root, name + ".json")
+        self.lock_path = os.path.join(root, name + ".lock")
+        self.max_age = max_age
+        self._owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._locked = False
+
+    def _marker(self):
+        try:
+            with open(self.marker_path, "r", encoding="utf-8") as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    # -- exclusive use -----------------------------------------------------
+
+    def _lock_is_stale(self):
+        try:
+            with open(self.lock_path, "r", encoding="utf-8") as fh:
+                host, _, pid = fh.read().strip().rpartition(":")
+            age = time.time() - os.path.getmtime(self.lock_path)
+        except (OSError, ValueError):
+            return False  # vanished or half-written: just try again
+        if host == socket.gethostname() and pid.isdigit() and os.name != "nt":
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                return False
+            return False
+        return age > PROFILE_LOCK_STALE_SEC
+
+    def acquire(self):
+        """Take the profile for this process; False if another run is using it."""
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        for _ in range(2):
+            try:
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._lock_is_stale():
+                    return False
+                # Move it aside first so two processes never both remove a lock
+                aside = f"{self.lock_path}.{uuid.uuid4().hex}.stale"
+                try:
+                    os.rename(self.lock_path, aside)
+                    os.remove(aside)
+                except OSError:
+                    pass
+                continue
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                fh.write(self._owner)
+            self._locked = True
+            return True
+        return False
+
+    def release(self):
+        if not self._locked:
+            return
+        self._locked = False
+        try:
+            with open(self.lock_path, "r", encoding="utf-8") as fh:
+                mine = fh.read().strip() == self._owner
+            if mine:
+                os.remove(self.lock_path)
+        except OSError:
+            pass
+
+    # -- saved session -----------------------------------------------------
+
+    def prepare(self):
+        """Make the profile ready for launch; True if a saved session will be reused."""
+        marker = self._marker()
+        valid = (marker is not None and os.path.isdir(self.user_data_dir)
+                 and time.time() - marker.get("saved_at", 0) <= self.max_age)
+        if not valid:
+            self.invalidate()
+        else:
+            # Only mark_valid() writes it back: a run that fails or is killed from
+            # here on leaves the profile unmarked, and the next run starts fresh
+            os.remove(self.marker_path)
+        os.makedirs(self.user_data_dir, exist_ok=True)
+        return valid
+
+    def mark_valid(self, url=None):
+        """Record that the data in the profile belongs to a successful run."""
+        with open(self.marker_path, "w", encoding="utf-8") as fh:
+            json.dump({"saved_at": time.time(), "url": url}, fh)
+
+    def invalidate(self):
+        """Forget the saved session (marker and browser data)."""
+        try:
+            os.remove(self.marker_path)
+        except OSError:
+            pass
+        shutil.rmtree(self.user_data_dir, ignore_errors=True)
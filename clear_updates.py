@@ -12,9 +12,9 @@ This avoids your long-polling listener immediately seeing old messages when it s
 """
 
 import requests
-from config import TELEGRAM_BOT_TOKEN
+from config import TELEGRAM_API_BASE, TELEGRAM_BOT_TOKEN
 
-API = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
+API = f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}"
 
 
 def get_updates():
@@ -29,6 +29,10 @@ if ENV_PATH.exists():
 # Values are read from environment variables. For production, do NOT keep hardcoded secrets here.
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
+# Base URL of the Bot API. Override to point at a local stand-in (see fake_telegram_api.py).
+TELEGRAM_API_BASE = (os.getenv("TELEGRAM_API_BASE")
+                     or "https://api.telegram.org").rstrip("/")
+
 # Support either a single chat id or multiple comma-separated chat ids.
 _single_chat_id = (os.getenv("TELEGRAM_CHAT_ID") or "").strip()
 _multi_chat_ids = (os.getenv("TELEGRAM_CHAT_IDS") or "").strip()
@@ -44,6 +48,26 @@ else:
 # Backward-compat single value (first of the list, or empty string)
 TELEGRAM_CHAT_ID = TELEGRAM_CHAT_IDS[0] if TELEGRAM_CHAT_IDS else ""
 
+# Booking page used by main.py (override with VISIT_URL, e.g. to point at a test site)
+DEFAULT_VISIT_URL = "http://visitbrp.com/%E0%B8%A3%E0%B8%B0%E0%B8%9A%E0%B8%9A%E0%B8%88%E0%B8%AD%E0%B8%87%E0%B9%80%E0%B8%A2%E0%B8%B5%E0%B9%88%E0%B8%A2%E0%B8%A1%E0%B8%8D%E0%B8%B2%E0%B8%95%E0%B8%B4/"
+
+# Outgoing message pacing (see telegram_helper.TelegramDispatcher). Telegram allows
+# roughly 30 messages/s overall and 1 message/s per chat; stay a little below that.
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE") or 25)
+TELEGRAM_GLOBAL_BURST = float(os.getenv("TELEGRAM_GLOBAL_BURST") or 3)
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE") or 1)
+TELEGRAM_SEND_WORKERS = int(os.getenv("TELEGRAM_SEND_WORKERS") or 4)
+# Every process paces only its own sends, so processes that may send at the same time
+# split the limits above. Of TELEGRAM_RATE_SHARE, main.py uses TELEGRAM_RUN_SHARE and
+# the listener the rest, so a booking result never waits behind the listener's
+# acknowledgements. With several listener instances (each may run main.py), set
+# TELEGRAM_RATE_SHARE on each so that the instances' shares add up to at most 1.
+TELEGRAM_RATE_SHARE = float(os.getenv("TELEGRAM_RATE_SHARE") or 1)
+TELEGRAM_RUN_SHARE = float(os.getenv("TELEGRAM_RUN_SHARE") or 0.5)
+if not (0 < TELEGRAM_RATE_SHARE <= 1 and 0 < TELEGRAM_RUN_SHARE < 1):
+    raise RuntimeError(
+        "TELEGRAM_RATE_SHARE must be in (0, 1] and TELEGRAM_RUN_SHARE in (0, 1)")
+
 # Fail fast only for the required token; chat id(s) can be optional depending on app policy.
 if not TELEGRAM_BOT_TOKEN:
     raise RuntimeError(
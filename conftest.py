@@ -0,0 +1,12 @@
+import os
+import tempfile
+
+# test_telegram.py is a manual check that sends real messages with the configured
+# bot; keep it out of `pytest` runs.
+collect_ignore = ["test_telegram.py"]
+
+# The listener and helpers read their configuration at import time: give them a dummy
+# token, an API address where nothing listens and a throwaway coordination directory.
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "TEST")
+os.environ["TELEGRAM_API_BASE"] = "http://127.0.0.1:9"
+os.environ["COORD_DIR"] = tempfile.mkdtemp(prefix="visit-test-")
@@ -0,0 +1,295 @@
+"""
+Lease and claim primitives so several listener instances can share the work safely.
+
+All state lives in a directory (COORD_DIR, default `.coord/` next to this file).
+Processes on one machine share it as-is; for several hosts point COORD_DIR at a shared
+file system (NFSv3+/SMB) that supports exclusive create. Every operation is built on
+two atomic file-system calls, so no extra service is needed:
+
+- `os.open(..., O_CREAT | O_EXCL)` for mutexes and one-shot job claims;
+- write-to-temp + `os.replace()` for lease and state documents.
+
+Leases carry a wall-clock expiry, so keep the hosts' clocks in sync (NTP); the default
+TTL of 10 s tolerates small skew.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+COORD_DIR = os.getenv("COORD_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".coord")
+LEASE_TTL_SEC = float(os.getenv("LEASE_TTL_SEC") or 10)
+LEASE_RENEW_SEC = float(os.getenv("LEASE_RENEW_SEC") or 3)
+MUTEX_STALE_SEC = 30  # a mutex file older than this is assumed to belong to a dead process
+
+# Identifies this process in leases and claims
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class FileLeaseStore:
+    def __init__(self, root=COORD_DIR, mutex_stale_sec=MUTEX_STALE_SEC):
+        self.root = root
+        self.mutex_stale_sec = mutex_stale_sec
+        for sub in ("locks", "leases", "claims", "state"):
+            os.makedirs(os.path.join(root, sub), exist_ok=True)
+
+    def _path(self, kind, name):
+        safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in str(name))
+        return os.path.join(self.root, kind, safe + ".json")
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write(path, data):
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(data, fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, path)
+
+    # -- mutex -------------------------------------------------------------
+
+    @staticmethod
+    def _read_token(path):
+        try:
+            with open(path, "rb") as fh:
+                return fh.read()
+        except OSError:
+            return None
+
+    def _break_stale(self, path):
+        """
+        Remove the lock file at `path` if it is stale, without racing other breakers.
+
+        The file is first renamed to a unique name, which only one process can do
+        for a given file, and its age is checked on the renamed file. If what was
+        moved aside turns out to be a fresh lock (re-created after another breaker
+        removed the stale one), it is put back with link(), which fails instead of
+        overwriting if yet another lock appeared meanwhile.
+        """
+        aside = f"{path}.{uuid.uuid4().hex}.stale"
+        try:
+            os.rename(path, aside)
+        except OSError:
+            return  # already broken (or released) by someone else
+        try:
+            fresh = time.time() - os.path.getmtime(aside) <= self.mutex_stale_sec
+        except OSError:
+            fresh = False
+        if fresh:
+            try:
+                os.link(aside, path)
+            except OSError:
+                pass
+        try:
+            os.remove(aside)
+        except OSError:
+            pass
+
+    @contextmanager
+    def mutex(self, name, timeout=10.0):
+        """Cross-process mutual exclusion for short critical sections."""
+        path = self._path("locks", name)
+        # Unique per acquisition, so releasing never removes a lock taken by someone else
+        token = f"{INSTANCE_ID}:{uuid.uuid4().hex}".encode("utf-8")
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, token)
+                os.close(fd)
+                break
+            except FileExistsError:
+                try:
+                    stale = time.time() - os.path.getmtime(path) > self.mutex_stale_sec
+                except OSError:
+                    continue
+                if stale:
+                    self._break_stale(path)
+                    continue
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"could not acquire mutex {name!r}")
+                time.sleep(0.01)
+        try:
+            yield
+        finally:
+            # Only remove our own lock (it may have been broken as stale meanwhile)
+            if self._read_token(path) == token:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    # -- leases ------------------------------------------------------------
+
+    def acquire_lease(self, name, holder, ttl):
+        """Take or renew lease `name` for `holder`; True if `holder` now holds it."""
+        path = self._path("leases", name)
+        with self.mutex("lease-" + name):
+            now = time.time()
+            current = self._read(path)
+            if current and current.get("holder") != holder and current.get("expires_at", 0) > now:
+                return False
+            self._write(path, {"holder": holder, "expires_at": now + ttl,
+                               "renewed_at": now})
+            return True
+
+    def release_lease(self, name, holder):
+        path = self._path("leases", name)
+        with self.mutex("lease-" + name):
+            current = self._read(path)
+            if current and current.get("holder") == holder:
+                os.remove(path)
+
+    def lease_info(self, name):
+        """Current lease document ({holder, expires_at, renewed_at}) or None if free."""
+        current = self._read(self._path("leases", name))
+        if current and current.get("expires_at", 0) > time.time():
+            return current
+        return None
+
+    # -- claims ------------------------------------------------------------
+
+    def claim(self, key, holder):
+        """Claim `key` exactly once across all instances; True for the single winner."""
+        try:
+            fd = os.open(self._path("claims", key),
+                         os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump({"holder": holder, "claimed_at": time.time()}, fh)
+        return True
+
+    def release_claim(self, key):
+        """Give a claim back (e.g. when the claimed job could not be started)."""
+        try:
+            os.remove(self._path("claims", key))
+        except OSError:
+            pass
+
+    def prune_claims(self, older_than_sec):
+        cutoff = time.time() - older_than_sec
+        claims_dir = os.path.join(self.root, "claims")
+        for entry in os.listdir(claims_dir):
+            path = os.path.join(claims_dir, entry)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    # -- small shared values -------------------------------------------------
+
+    def get_value(self, name, default=None, max_age=None):
+        """Stored value, or `default` if missing or last written more than `max_age` s ago."""
+        data = self._read(self._path("state", name))
+        if not data or "value" not in data:
+            return default
+        if max_age is not None and time.time() - data.get("updated_at", 0) > max_age:
+            return default
+        return data["value"]
+
+    def set_value(self, name, value):
+        self._write(self._path("state", name), {"value": value, "updated_at": time.time()})
+
+    def delete_value(self, name):
+        try:
+            os.remove(self._path("state", name))
+        except OSError:
+            pass
+
+    def list_values(self, prefix, max_age=None):
+        """Values of every state entry whose name starts with `prefix` (and is fresh enough)."""
+        safe_prefix = os.path.basename(self._path("state", prefix))[:-len(".json")]
+        state_dir = os.path.join(self.root, "state")
+        values = []
+        for entry in sorted(os.listdir(state_dir)):
+            if not entry.startswith(safe_prefix) or not entry.endswith(".json"):
+                continue
+            data = self._read(os.path.join(state_dir, entry))
+            if not data or "value" not in data:
+                continue
+            if max_age is not None and time.time() - data.get("updated_at", 0) > max_age:
+                continue
+            values.append(data["value"])
+        return values
+
+
+class LeaseKeeper:
+    """
+    Background thread that keeps trying to acquire, then renew, one lease.
+
+    `held` is a conservative local view: it turns False as soon as a renewal is
+    overdue, before the lease can expire in the store and another instance take over.
+    """
+
+    def __init__(self, store, name, holder=INSTANCE_ID, ttl=LEASE_TTL_SEC,
+                 renew_every=LEASE_RENEW_SEC):
+        if renew_every >= ttl:
+            raise ValueError("renew_every must be shorter than ttl")
+        self.store = store
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+        self.renew_every = renew_every
+        self._valid_until = 0.0  # monotonic
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def held(self):
+        return time.monotonic() < self._valid_until
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"lease-{self.name}",
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._valid_until = 0.0
+        try:
+            self.store.release_lease(self.name, self.holder)
+        except Exception:
+            pass
+
+    def wait_held(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.held and not self._stop.is_set():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(min(0.1, self.renew_every))
+        return self.held
+
+    def _run(self):
+        was_held = False
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                ok = self.store.acquire_lease(self.name, self.holder, self.ttl)
+            except Exception as e:
+                print(f"Lease {self.name}: store error: {e}")
+                ok = False
+            if ok:
+                # Count from before the write so our view expires no later than the store's
+                self._valid_until = started + self.ttl - self.renew_every
+            else:
+                self._valid_until = 0.0
+            if ok != was_held:
+                print(f"Lease {self.name}: {'acquired' if ok else 'lost'} by {self.holder}")
+                was_held = ok
+            self._stop.wait(self.renew_every)
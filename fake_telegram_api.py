@@ -0,0 +1,298 @@
+"""
+Local stand-in for the parts of the Telegram Bot API used by this project.
+
+Usage:
+    python fake_telegram_api.py --port 8081
+    # then point the listener / helpers at it:
+    #   TELEGRAM_API_BASE=http://127.0.0.1:8081
+
+What it does:
+- Serves `getUpdates` (with offset confirmation and long-polling) and `sendMessage`
+  on `/bot<token>/<method>`, returning the same JSON envelope as Telegram.
+- Optionally enforces Telegram's rate limits (~30 messages/s overall, 1 message/s
+  per chat) and answers with HTTP 429 plus `parameters.retry_after`, like the real API.
+- Can inject random 429s and slow responses to exercise retry/back-off paths.
+- Records every injected update and every sent message so a harness can measure
+  throughput, latency and drops (see load_test.py).
+
+Everything runs in-process on 127.0.0.1; no network access is needed.
+"""
+
+import argparse
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeTelegramAPI:
+    """In-process fake Bot API server. Call start() / stop() around use."""
+
+    def __init__(self, host="127.0.0.1", port=0, token=None,
+                 latency=0.0, latency_jitter=0.0,
+                 random_429_rate=0.0, retry_after=1,
+                 enforce_limits=True, global_rate=30, chat_rate=1,
+                 max_long_poll: Optional[float] = None, seed=None):
+        self.host = host
+        self.port = port
+        self.token = token  # None accepts any token
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.random_429_rate = random_429_rate
+        self.retry_after = retry_after
+        self.enforce_limits = enforce_limits
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.max_long_poll = max_long_poll
+        self._rng = random.Random(seed)
+
+        self._cond = threading.Condition()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._queue = []  # pending update dicts, ordered by update_id
+
+        # Recorded activity (read by harnesses once the run is over)
+        self.injected = {}   # update_id -> monotonic time the update was queued
+        self.delivered = {}  # update_id -> monotonic time first returned by getUpdates
+        self.sent = []       # (monotonic time, chat_id, text) for accepted sendMessage calls
+        self.rejected_429 = 0
+        self.get_updates_calls = 0
+
+        self._global_window = deque()
+        self._chat_windows = {}
+
+        self._server = None
+        self._thread = None
+
+    # -- lifecycle ---------------------------------------------------------
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self._server.server_address[1]}"
+
+    def start(self):
+        api = self
+
+        class Handler(_Handler):
+            fake = api
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        with self._cond:
+            self._cond.notify_all()
+
+    # -- test driver API ---------------------------------------------------
+
+    def push_message(self, chat_id, text):
+        """Queue an incoming text message from `chat_id`; returns its update_id."""
+        with self._cond:
+            update_id = next(self._update_ids)
+            self._queue.append({
+                "update_id": update_id,
+                "message": {
+                    "message_id": next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": int(chat_id), "type": "private"},
+                    "text": text,
+                },
+            })
+            self.injected[update_id] = time.monotonic()
+            self._cond.notify_all()
+        return update_id
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._queue)
+
+    # -- Bot API methods ---------------------------------------------------
+
+    def get_updates(self, params):
+        offset = _as_int(params.get("offset"))
+        limit = _as_int(params.get("limit")) or 100
+        timeout = float(params.get("timeout") or 0)
+        if self.max_long_poll is not None:
+            timeout = min(timeout, self.max_long_poll)
+        deadline = time.monotonic() + timeout
+
+        with self._cond:
+            self.get_updates_calls += 1
+            if offset is not None:
+                # Telegram forgets every update below the confirmed offset
+                self._queue = [
+                    u for u in self._queue if u["update_id"] >= offset]
+            while not self._queue and self._server is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._queue[:limit]
+            now = time.monotonic()
+            for u in batch:
+                self.delivered.setdefault(u["update_id"], now)
+        return 200, {"ok": True, "result": batch}
+
+    def send_message(self, params):
+        chat_id = params.get("chat_id")
+        text = params.get("text")
+        if chat_id in (None, "") or not text:
+            return 400, {"ok": False, "error_code": 400,
+                         "description": "Bad Request: chat_id and text are required"}
+
+        if self.random_429_rate and self._rng.random() < self.random_429_rate:
+            return self._too_many(self.retry_after)
+
+        now = time.monotonic()
+        with self._cond:
+            if self.enforce_limits:
+                wait = self._limit_wait(now, str(chat_id))
+                if wait > 0:
+                    return self._too_many(max(1, math.ceil(wait)))
+            self.sent.append((now, str(chat_id), text))
+            message_id = next(self._message_ids)
+        return 200, {"ok": True, "result": {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id},
+            "text": text,
+        }}
+
+    def _limit_wait(self, now, chat_id):
+        """Return seconds until a send is allowed (0 if allowed now, which records it)."""
+        window = self._chat_windows.setdefault(chat_id, deque())
+        for w in (self._global_window, window):
+            while w and now - w[0] >= 1.0:
+                w.popleft()
+        wait = 0.0
+        if len(self._global_window) >= self.global_rate:
+            wait = max(wait, 1.0 - (now - self._global_window[0]))
+        if len(window) >= self.chat_rate:
+            wait = max(wait, 1.0 - (now - window[0]))
+        if wait <= 0:
+            self._global_window.append(now)
+            window.append(now)
+        return wait
+
+    def _too_many(self, retry_after):
+        with self._cond:
+            self.rejected_429 += 1
+        return 429, {"ok": False, "error_code": 429,
+                     "description": f"Too Many Requests: retry after {retry_after}",
+                     "parameters": {"retry_after": retry_after}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    fake = None  # set on the per-server subclass
+
+    def do_GET(self):
+        self._dispatch(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        ctype = self.headers.get("Content-Type", "")
+        params = parse_qs(urlparse(self.path).query)
+        if raw and "json" in ctype:
+            try:
+                params.update(json.loads(raw.decode("utf-8")))
+            except ValueError:
+                self._reply(400, {"ok": False, "error_code": 400,
+                                  "description": "Bad Request: invalid JSON"})
+                return
+        elif raw:
+            params.update(parse_qs(raw.decode("utf-8")))
+        self._dispatch(params)
+
+    def _dispatch(self, params):
+        # parse_qs gives lists; JSON bodies give scalars
+        params = {k: (v[-1] if isinstance(v, list) else v)
+                  for k, v in params.items()}
+        parts = urlparse(self.path).path.strip("/").split("/")
+        fake = self.fake
+        if len(parts) != 2 or not parts[0].startswith("bot"):
+            self._reply(404, {"ok": False, "error_code": 404,
+                              "description": "Not Found"})
+            return
+        if fake.token is not None and parts[0][3:] != fake.token:
+            self._reply(401, {"ok": False, "error_code": 401,
+                              "description": "Unauthorized"})
+            return
+
+        if fake.latency or fake.latency_jitter:
+            time.sleep(fake.latency + fake._rng.random() * fake.latency_jitter)
+
+        method = parts[1]
+        if method == "getUpdates":
+            status, body = fake.get_updates(params)
+        elif method == "sendMessage":
+            status, body = fake.send_message(params)
+        elif method == "getMe":
+            status, body = 200, {"ok": True, "result": {
+                "id": 1, "is_bot": True, "username": "fake_visit_bot"}}
+        else:
+            status, body = 404, {"ok": False, "error_code": 404,
+                                 "description": "Not Found: method not found"}
+        self._reply(status, body)
+
+    def _reply(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        # Keep the console quiet; the harness reports aggregate numbers instead.
+        pass
+
+
+def _as_int(value):
+    try:
+        return int(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="fixed delay added to every response (seconds)")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="random extra delay up to this many seconds")
+    parser.add_argument("--random-429", type=float, default=0.0,
+                        help="probability of answering sendMessage with 429")
+    parser.add_argument("--no-limits", action="store_true",
+                        help="do not enforce the global / per-chat rate limits")
+    args = parser.parse_args()
+
+    server = FakeTelegramAPI(port=args.port, latency=args.latency,
+                             latency_jitter=args.jitter,
+                             random_429_rate=args.random_429,
+                             enforce_limits=not args.no_limits).start()
+    print(f"Fake Telegram Bot API listening on {server.base_url}")
+    print(f"Set TELEGRAM_API_BASE={server.base_url} to use it. Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
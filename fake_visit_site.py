@@ -0,0 +1,181 @@
+"""
+Local stand-in for the VisitBRP booking pages, for benchmarks and offline runs of main.py.
+
+Usage:
+    python fake_visit_site.py --port 8082
+    # then:
+    #   VISIT_URL=http://127.0.0.1:8082/ uv run python main.py
+
+What it does:
+- Serves the same sequence of forms main.py walks through, with the same selectors:
+  prisoner checkbox (`label[for='cbxname1']`, `input.submit`) -> `#idno` -> prisoner
+  confirmation -> `#search_idno` with "เพิ่ม"/"ตกลง" -> `#dd`, `#round`, `#mobile`.
+- Keeps a cookie session: once the visitor ID and prisoner have been confirmed, opening
+  the start page again jumps straight to the visitor step, like a restored session.
+- Also serves `/availability` (just the `#dd`/`#round` selects) as an AVAILABILITY_URL
+  for offline runs of availability_watcher.py; the real site has no such page.
+- Counts completed bookings; an optional delay per response simulates a slow site.
+"""
+
+import argparse
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+_PAGE = """<!doctype html>
+<html><head><meta charset="utf-8"><title>VisitBRP (fake)</title></head>
+<body>{body}</body></html>"""
+
+_PRISONER_FORM = """<form method="post" action="{action}">
+<input type="checkbox" id="cbxname1" name="prisoner" value="1">
+<label for="cbxname1">นักโทษ 1</label>
+<input type="submit" class="submit" value="ถัดไป">
+</form>"""
+
+_IDNO_FORM = """<form method="post" action="/prisoner">
+<input id="idno" name="idno">
+<input type="submit" class="submit" value="ถัดไป">
+</form>"""
+
+_VISITORS_FORM = """<form method="post" action="/slot">
+<input id="search_idno" name="search_idno">
+<input type="button" value="เพิ่ม" onclick="document.getElementById('added').textContent = document.getElementById('search_idno').value">
+<span id="added"></span>
+<input type="submit" class="submit" value="ตกลง">
+</form>"""
+
+
+def _slot_selects(days, rounds):
+    day_opts = "".join(f'<option value="{d}">{d}</option>' for d in days)
+    round_opts = "".join(f'<option value="{r}">{r}</option>' for r in rounds)
+    return (f'<select id="dd" name="dd"><option value="">-</option>{day_opts}</select>'
+            f'<select id="round" name="round">{round_opts}</select>')
+
+
+class FakeVisitSite:
+    """In-process fake booking site. Call start() / stop() around use."""
+
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0, open_days=None, rounds=("1", "2", "3")):
+        self.host = host
+        self.port = port
+        self.delay = delay
+        # By default tomorrow is bookable, as on a normal morning after release
+        self.open_days = open_days
+        self.rounds = list(rounds)
+        self.sessions = {}  # session id -> furthest confirmed stage
+        self.bookings = []  # dicts with the submitted booking form
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self._server.server_address[1]}/"
+
+    def days(self):
+        if self.open_days is not None:
+            return [str(d) for d in self.open_days]
+        return [str((datetime.now() + timedelta(days=1)).day)]
+
+    def start(self):
+        site = self
+
+        class Handler(_Handler):
+            fake = site
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def render(self, path, session, form):
+        """Return (body html, new stage or None) for a request."""
+        stage = self.sessions.get(session)
+        if path == "/":
+            if stage == "visitors":
+                return _VISITORS_FORM, None
+            return _PRISONER_FORM.format(action="/idno"), None
+        if path == "/idno":
+            return _IDNO_FORM, None
+        if path == "/prisoner":
+            return _PRISONER_FORM.format(action="/visitors"), None
+        if path == "/visitors":
+            return _VISITORS_FORM, "visitors"
+        if path == "/slot":
+            return ('<form method="post" action="/done">'
+                    + _slot_selects(self.days(), self.rounds)
+                    + '<input id="mobile" name="mobile">'
+                    + '<input type="submit" value="ตกลง"></form>'), None
+        if path == "/done":
+            with self._lock:
+                self.bookings.append(form)
+            return '<p id="result">จองสำเร็จ</p>', None
+        if path == "/availability":
+            return _slot_selects(self.days(), self.rounds), None
+        return None, None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    fake = None  # set on the per-server subclass
+
+    def do_GET(self):
+        self._respond({})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length).decode("utf-8") if length else ""
+        self._respond({k: v[-1] for k, v in parse_qs(raw).items()})
+
+    def _respond(self, form):
+        fake = self.fake
+        if fake.delay:
+            time.sleep(fake.delay)
+        session = None
+        for part in (self.headers.get("Cookie") or "").split(";"):
+            name, _, value = part.strip().partition("=")
+            if name == "PHPSESSID":
+                session = value
+        new_cookie = None
+        if session is None:
+            session = new_cookie = secrets.token_hex(8)
+
+        body, stage = fake.render(urlparse(self.path).path, session, form)
+        if body is None:
+            self.send_error(404)
+            return
+        if stage:
+            fake.sessions[session] = stage
+        data = _PAGE.format(body=body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        if new_cookie:
+            self.send_header("Set-Cookie", f"PHPSESSID={new_cookie}; Path=/; Max-Age=86400")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--delay", type=float, default=0.0,
+                        help="seconds added to every response")
+    args = parser.parse_args()
+    site = FakeVisitSite(port=args.port, delay=args.delay).start()
+    print(f"Fake booking site on {site.base_url} (VISIT_URL={site.base_url}). Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        site.stop()
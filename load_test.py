@@ -0,0 +1,332 @@
+"""
+Offline load test for telegram_listener.py against a fake Telegram Bot API.
+
+Usage:
+    python load_test.py                        # defaults: 2000 updates from 20 chats
+    python load_test.py --updates 5000 --chats 50 --rate 500 --latency 0.05
+    python load_test.py --json report.json     # also write the report as JSON
+
+What it does:
+- Starts fake_telegram_api.FakeTelegramAPI on 127.0.0.1 and points the listener at it
+  (TELEGRAM_API_BASE), with the synthetic chats as TELEGRAM_CHAT_IDS.
+- Moves the listener's schedule to the next minute boundary so the burst happens just
+  before the "09:30" launch, like chats spamming commands at 09:29.
+- Replaces the booking subprocess with a short `sleep` child so no browser is started.
+- Runs `telegram_listener.main()` in a background thread, injects a mix of commands and
+  reports command throughput, reply latency percentiles, dropped updates, sendMessage
+  outcomes (accepted / 429), notifier queue/delay and scheduler launch jitter.
+- Reply latency runs from injecting a command to the fake API accepting the first reply
+  to it in the sender's chat. Replies are queued, so each one is tagged with the update
+  it answers ("#r<n>" appended to the text) to find it among the sent messages.
+
+Nothing here talks to the real Telegram API or the booking site.
+"""
+
+import argparse
+import io
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from fake_telegram_api import FakeTelegramAPI
+
+DEFAULT_MIX = "start=5,status=2,pending=1,text=1,cancel=1"
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of `values` (None for an empty list)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100.0 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(values, scale=1000.0):
+    """p50/p90/p99/max of `values` converted to milliseconds."""
+    out = {}
+    for name, pct in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100)):
+        v = percentile(values, pct)
+        out[name] = round(v * scale, 1) if v is not None else None
+    return out
+
+
+def parse_mix(spec):
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        mix.append((name.strip(), int(weight or 1)))
+    return mix
+
+
+def make_command(kind, rng):
+    if kind == "start":
+        return rng.choice(["/start", "/start 1", "/start 2", "run 3"])
+    if kind == "status":
+        return "/status"
+    if kind == "pending":
+        return "/pending"
+    if kind == "cancel":
+        return f"/cancel {rng.randint(1, 50)}"
+    return rng.choice(["hello", "book please", "พรุ่งนี้"])
+
+
+def next_schedule_target(lead_sec):
+    """Next whole minute at least `lead_sec` seconds away."""
+    now = datetime.now()
+    target = (now + timedelta(minutes=1)).replace(second=0, microsecond=0)
+    if (target - now).total_seconds() < lead_sec:
+        target += timedelta(minutes=1)
+    return target
+
+
+def reply_latencies(injected, replies, sent):
+    """
+    Per answered update: seconds from injection until the API accepted the first reply
+    to it in the sender's chat. `replies` maps reply tags to (update_id, chat_id);
+    updates whose replies were never delivered are left out.
+    """
+    first = {}  # update_id -> monotonic time of the first delivered reply
+    for accepted_at, chat_id, text in sent:
+        tag = text.rsplit(" ", 1)[-1]
+        answering = replies.get(tag)
+        if answering is None or answering[1] != chat_id:
+            continue
+        update_id = answering[0]
+        if update_id not in first or accepted_at < first[update_id]:
+            first[update_id] = accepted_at
+    return [t - injected[uid] for uid, t in first.items() if uid in injected]
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    api = FakeTelegramAPI(latency=args.latency, latency_jitter=args.jitter,
+                          random_429_rate=args.random_429,
+                          enforce_limits=not args.no_limits,
+                          max_long_poll=2.0, seed=args.seed).start()
+    chats = [str(100000 + i) for i in range(args.chats)]
+
+    # The listener reads its configuration at import time.
+    os.environ["TELEGRAM_API_BASE"] = api.base_url
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "LOADTEST")
+    os.environ["TELEGRAM_CHAT_IDS"] = ",".join(chats)
+    workdir = tempfile.mkdtemp(prefix="visit-loadtest-")
+    os.environ["COORD_DIR"] = workdir  # fresh lease/claim store for this run
+    import telegram_listener
+
+    telegram_listener.PENDING_RUNS_FILE = os.path.join(
+        workdir, "pending_runs.json")
+    target = next_schedule_target(args.lead)
+    telegram_listener.SCHEDULE_HOUR = target.hour
+    telegram_listener.SCHEDULE_MINUTE = target.minute
+    telegram_listener.SCHEDULER_WAKE_SEC = args.scheduler_wake
+
+    launches = []  # (wall time, thread name, round)
+    handled = {}   # update_id -> (start, end) monotonic
+    replies = {}   # reply tag -> (update_id, chat_id) of the command it answers
+    lock = threading.Lock()
+    current = threading.local()  # update being handled by this thread
+    tag_ids = itertools.count(1)
+
+    def fake_booking(round_arg=None):
+        with lock:
+            launches.append((time.time(), threading.current_thread().name,
+                             round_arg))
+        return subprocess.Popen(
+            [sys.executable, "-c", f"import time; time.sleep({args.booking_sec})"])
+
+    real_handle_update = telegram_listener.handle_update
+
+    def timed_handle_update(update):
+        t0 = time.monotonic()
+        message = update.get("message") or {}
+        current.update = (update.get("update_id"), str(message.get("chat", {}).get("id")))
+        try:
+            real_handle_update(update)
+        finally:
+            current.update = None
+            with lock:
+                handled.setdefault(update.get("update_id"),
+                                   (t0, time.monotonic()))
+
+    real_send_ack = telegram_listener.send_ack
+
+    def tagged_send_ack(text, chat_id=None):
+        answering = getattr(current, "update", None)
+        if answering is not None:
+            tag = f"#r{next(tag_ids)}"
+            with lock:
+                replies[tag] = answering
+            text = f"{text} {tag}"
+        return real_send_ack(text, chat_id)
+
+    telegram_listener.start_automation_subprocess = fake_booking
+    telegram_listener.handle_update = timed_handle_update
+    telegram_listener.send_ack = tagged_send_ack
+
+    # The listener prints every message it sees; keep that off the console unless
+    # asked, but hold on to the real stream for our own progress lines.
+    console = sys.stdout
+    if not args.verbose:
+        sys.stdout = io.StringIO()
+    try:
+        return _drive(args, api, rng, chats, target, telegram_listener,
+                      launches, handled, replies, lock, console)
+    finally:
+        sys.stdout = console
+
+
+def _drive(args, api, rng, chats, target, telegram_listener, launches,
+           handled, replies, lock, console):
+    listener = threading.Thread(target=telegram_listener.main,
+                                name="listener", daemon=True)
+    listener.start()
+
+    # Wait for the startup backlog check before injecting traffic.
+    deadline = time.monotonic() + 10
+    while api.get_updates_calls < 2 and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    mix = parse_mix(args.mix)
+    kinds = [k for k, _ in mix]
+    weights = [w for _, w in mix]
+    print(f"Injecting {args.updates} updates from {args.chats} chats at "
+          f"{args.rate}/s; scheduled launch at {target:%H:%M:%S}", file=console)
+    t_start = time.monotonic()
+    interval = 1.0 / args.rate if args.rate > 0 else 0.0
+    for i in range(args.updates):
+        due = t_start + i * interval
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        kind = rng.choices(kinds, weights)[0]
+        api.push_message(rng.choice(chats), make_command(kind, rng))
+    t_injected = time.monotonic()
+
+    # Drain: wait until every injected update has been handled (or give up).
+    deadline = time.monotonic() + args.drain_timeout
+    while time.monotonic() < deadline:
+        with lock:
+            done = len(handled)
+        if done >= len(api.injected):
+            break
+        time.sleep(0.1)
+    t_drained = time.monotonic()
+
+    # Let the notifier flush what the listener queued (same overall deadline).
+    from telegram_helper import get_dispatcher
+    dispatcher = get_dispatcher()
+    while time.monotonic() < deadline and dispatcher.stats()["queue_depth"]:
+        time.sleep(0.1)
+    t_flushed = time.monotonic()
+
+    # Give the scheduler a chance to fire at the target time.
+    wait_until = target.timestamp() + args.scheduler_wake + 2
+    while time.time() < wait_until:
+        with lock:
+            if any(name != "listener" for _, name, _ in launches):
+                break
+        time.sleep(0.2)
+
+    with lock:
+        handled_snapshot = dict(handled)
+        launch_snapshot = list(launches)
+        reply_snapshot = dict(replies)
+    notifier = dispatcher.stats()
+    api.stop()
+
+    injected = api.injected
+    latencies = reply_latencies(injected, reply_snapshot, api.sent)
+    queue_waits = [handled_snapshot[uid][0] - t_in
+                   for uid, t_in in injected.items() if uid in handled_snapshot]
+    service = [end - start for start, end in handled_snapshot.values()]
+    processed = len(handled_snapshot)
+    elapsed = max(t_drained - t_start, 1e-9)
+    scheduled = [ts for ts, name, _ in launch_snapshot if name != "listener"]
+    jitter = [ts - target.timestamp() for ts in scheduled]
+
+    report = {
+        "updates_injected": len(injected),
+        "updates_processed": processed,
+        "updates_dropped": len(injected) - processed,
+        "injection_sec": round(t_injected - t_start, 3),
+        "drain_sec": round(elapsed, 3),
+        "throughput_per_sec": round(processed / elapsed, 1),
+        "updates_answered": len({uid for uid, _ in reply_snapshot.values()}),
+        "replies_delivered": len(latencies),
+        "reply_latency_ms": summarize(latencies),
+        "queue_wait_ms": summarize(queue_waits),
+        "handler_time_ms": summarize(service),
+        "notify_flush_sec": round(t_flushed - t_drained, 3),
+        "send_accepted": len(api.sent),
+        "send_rejected_429": api.rejected_429,
+        "notifier_queue_left": notifier["queue_depth"],
+        "notifier_delay_ms": {"avg": round(notifier["avg_delay"] * 1000, 1),
+                              "max": round(notifier["max_delay"] * 1000, 1)},
+        "get_updates_calls": api.get_updates_calls,
+        "launches_immediate": sum(1 for _, n, _ in launch_snapshot if n == "listener"),
+        "launches_scheduled": len(scheduled),
+        "scheduler_jitter_ms": summarize(jitter),
+        "pending_left": len(telegram_listener.load_pending_runs()),
+        "commands": dict(telegram_listener.command_stats),
+    }
+    return report
+
+
+def print_report(report):
+    print()
+    print("=" * 60)
+    print("Listener load test")
+    print("=" * 60)
+    for key, value in report.items():
+        if isinstance(value, dict):
+            value = "  ".join(f"{k}={v}" for k, v in value.items())
+        print(f"{key:>22}: {value}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Drive synthetic Telegram updates through telegram_listener offline.")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=400.0,
+                        help="updates injected per second (0 = as fast as possible)")
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help=f"command weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="fake API response delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="extra random fake API delay in seconds")
+    parser.add_argument("--random-429", type=float, default=0.0,
+                        help="probability of a spurious 429 on sendMessage")
+    parser.add_argument("--no-limits", action="store_true",
+                        help="do not enforce Telegram rate limits in the fake API")
+    parser.add_argument("--booking-sec", type=float, default=0.5,
+                        help="how long each fake booking process runs")
+    parser.add_argument("--scheduler-wake", type=float, default=30,
+                        help="SCHEDULER_WAKE_SEC used by the listener")
+    parser.add_argument("--lead", type=float, default=15,
+                        help="minimum seconds between start and the scheduled launch")
+    parser.add_argument("--drain-timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", metavar="PATH",
+                        help="also write the report to this JSON file")
+    parser.add_argument("--verbose", action="store_true",
+                        help="show the listener's own console output")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
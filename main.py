@@ -1,9 +1,14 @@
-from playwright.sync_api import sync_playwright
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError, sync_playwright
 from datetime import datetime, timedelta
 import time
-from telegram_helper import send_dialog_alert, send_automation_status
+from telegram_helper import flush_telegram, get_dispatcher, send_dialog_alert, send_automation_status
+from config import DEFAULT_VISIT_URL, TELEGRAM_RATE_SHARE, TELEGRAM_RUN_SHARE
+from browser_profile import BrowserProfile, default_profile_name
+from process_memory import PeakRssSampler
 import sys
 import os
+import signal
+import threading
 from pathlib import Path
 
 # Load runtime configuration from .env or environment variables.
@@ -28,139 +33,378 @@ if ENV_PATH.exists():
             pass
 
 # Values used by the automation (can be set via .env or environment):
-VISIT_URL = os.getenv(
-    "VISIT_URL"
-)
+VISIT_URL = os.getenv("VISIT_URL") or DEFAULT_VISIT_URL
 ID_CARD1 = os.getenv("ID_CARD1")
 ID_CARD2 = os.getenv("ID_CARD2")
 MOBILE = os.getenv("MOBILE")
+# PERSIST_SESSION=1 keeps cookies/local storage/HTTP cache per profile between runs
+# (browser_profile.py) and resumes the flow at the step the site shows; off by default
+PERSIST_SESSION = os.getenv("PERSIST_SESSION", "0") == "1"
+# LOW_MEMORY=1 trims Chromium for small boards (see LOW_MEMORY_ARGS); the HTTP cache and
+# images/fonts/media are given up, cookies in the saved profile are still reused
+LOW_MEMORY = os.getenv("LOW_MEMORY", "0") == "1"
+
+# Telegram messages are only queued during the run so a slow or unreachable Bot API
+# never delays the booking; before exiting, wait this long for them to go out
+NOTIFY_FLUSH_SEC = 15
+NOTIFY_FLUSH_CANCELLED_SEC = 2  # keep /stop's teardown quick
+
+# Exit status used when a run is cancelled (128 + SIGTERM, as a shell would report it)
+EXIT_CANCELLED = 143
+
+# Set by the signal handler when the listener asks the run to stop; checked at step boundaries.
+_cancel_event = threading.Event()
+
+
+class BookingCancelled(Exception):
+    """Raised at the next step boundary after a stop request."""
+
+
+def _request_cancel(signum, frame):
+    # Only flag the request here; Playwright calls are not safe inside a signal handler.
+    print(f"Stop requested (signal {signum}); aborting at the next step...")
+    _cancel_event.set()
+
+
+def install_cancel_handlers():
+    """Turn SIGTERM (or CTRL_BREAK on Windows) into a cooperative cancellation request."""
+    for name in ("SIGTERM", "SIGBREAK"):
+        sig = getattr(signal, name, None)
+        if sig is not None:
+            signal.signal(sig, _request_cancel)
+
+
+def checkpoint(step):
+    """Abort the run between steps once a stop has been requested."""
+    if _cancel_event.is_set():
+        raise BookingCancelled(f"cancelled before: {step}")
+
+
+class SessionRejected(Exception):
+    """The restored browser session did not lead into the booking flow."""
+
+
+# Where the booking flow can resume, furthest first. `label[for='cbxname1']` is also
+# shown again after #idno, but without more context it is treated as the first page.
+ENTRY_STAGES = [
+    ("select_slot", "#dd"),
+    ("add_visitor", "#search_idno"),
+    ("enter_visitor_id", "#idno"),
+    ("select_prisoner", "label[for='cbxname1']"),
+]
+STEP_ORDER = ["select_prisoner", "enter_visitor_id",
+              "confirm_prisoner", "add_visitor", "select_slot"]
+
+
+LOW_MEMORY_ARGS = [
+    "--renderer-process-limit=1",      # one renderer for every page
+    "--disable-site-isolation-trials",  # ... which site isolation would otherwise split up
+    "--disable-gpu",
+    "--disable-extensions",
+    "--disable-component-extensions-with-background-pages",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--no-first-run",
+    "--mute-audio",
+    "--disable-features=Translate,MediaRouter,OptimizationHints,BackForwardCache",
+    "--disk-cache-size=1",
+    "--media-cache-size=1",
+    "--js-flags=--max-old-space-size=128",
+]
+LOW_MEMORY_VIEWPORT = {"width": 800, "height": 600}
+# The booking forms work without these; blocking them saves decoding memory and bandwidth
+LOW_MEMORY_BLOCKED_RESOURCES = {"image", "media", "font"}
+
+
+def launch_context(p, headless, profile):
+    """Launch Chromium, persistent (cookies, local storage, HTTP cache) when a profile is given."""
+    args = [
+        "--no-sandbox",                # harmless for non-root, useful under some services
+        "--disable-dev-shm-usage",     # avoids /dev/shm issues on small devices
+    ]
+    if LOW_MEMORY:
+        args += LOW_MEMORY_ARGS
+    if profile is None:
+        return p.chromium.launch(headless=headless, args=args)
+    options = {"viewport": LOW_MEMORY_VIEWPORT} if LOW_MEMORY else {}
+    return p.chromium.launch_persistent_context(
+        profile.user_data_dir, headless=headless, args=args, **options)
+
+
+def _block_heavy_resources(route):
+    if route.request.resource_type in LOW_MEMORY_BLOCKED_RESOURCES:
+        route.abort()
+    else:
+        route.continue_()
+
 
 def main(round_choice=None):
-    url = "http://visitbrp.com/%E0%B8%A3%E0%B8%B0%E0%B8%9A%E0%B8%9A%E0%B8%88%E0%B8%AD%E0%B8%87%E0%B9%80%E0%B8%A2%E0%B8%B5%E0%B9%88%E0%B8%A2%E0%B8%A1%E0%B8%8D%E0%B8%B2%E0%B8%95%E0%B8%B4/"
+    url = VISIT_URL
+    # The listener keeps the rest of the Telegram limits for itself (see config.py)
+    get_dispatcher(TELEGRAM_RATE_SHARE * TELEGRAM_RUN_SHARE)
 
     # Send automation start notification (include round if provided)
     details = "Beginning VisitBRP automation process"
     if round_choice:
         details += f" (round={round_choice})"
-    send_automation_status("Started", details, round_choice=round_choice)
-
+    send_automation_status("Started", details, round_choice=round_choice, wait=False)
+    if LOW_MEMORY:
+        print("Low-memory browser profile enabled")
+
+    profile = None
+    if PERSIST_SESSION:
+        profile = BrowserProfile(os.getenv("BROWSER_PROFILE")
+                                 or default_profile_name(ID_CARD1, ID_CARD2))
+        if not profile.acquire():
+            # Another run (e.g. a second listener instance) is using the same profile
+            print(f"Browser profile '{profile.name}' is in use; running without a saved session.")
+            profile = None
+
+    # Peak memory of this process plus the Playwright driver and Chromium, for the result
+    sampler = PeakRssSampler().start()
     try:
         headless = os.getenv("HEADLESS", "1") != "0"
         with sync_playwright() as p:
-            browser = p.chromium.launch(
-            headless=headless,
-            args=[
-                "--no-sandbox",                # harmless for non-root, useful under some services
-                "--disable-dev-shm-usage",     # avoids /dev/shm issues on small devices
-            ],
-        )
-            page = browser.new_page()
+            restored = profile.prepare() if profile else False
+            if restored:
+                print(f"Reusing saved browser session '{profile.name}'")
+            try:
+                run_in_browser(p, headless, profile, url, round_choice, restored)
+            except SessionRejected as e:
+                if not restored:
+                    raise  # a fresh browser (or no profile at all) has nothing to forget
+                # The saved session was not accepted: forget it and start over once
+                print(f"Saved session rejected ({e}); retrying with a fresh profile.")
+                profile.invalidate()
+                profile.prepare()
+                run_in_browser(p, headless, profile, url, round_choice, False)
+            if profile:
+                profile.mark_valid(url)
+        sampler.stop()
+        send_automation_status("Completed", with_memory(
+            "VisitBRP automation finished successfully", sampler), round_choice=round_choice,
+            wait=False)
+
+    except BookingCancelled as e:
+        sampler.stop()
+        print(with_memory(f"Automation cancelled ({e}); browser closed.", sampler))
+        raise
+    except Exception as e:
+        sampler.stop()
+        error_message = f"Automation failed with error: {str(e)}"
+        print(f"Error: {error_message}")
+        send_automation_status("Error", with_memory(error_message, sampler),
+                               round_choice=round_choice, wait=False)
+        raise
+    finally:
+        if profile:
+            profile.release()
+        sampler.stop()
+        flush_telegram(NOTIFY_FLUSH_CANCELLED_SEC if _cancel_event.is_set() else NOTIFY_FLUSH_SEC)
 
-            # Handle dialogs
-            def handle_dialog(dialog):
-                print(f"Dialog type: {dialog.type}")
-                print(f"Dialog message: {dialog.message}")
-                print("Alert visible for 15 seconds...")
 
-                # Send dialog alert to Telegram
-                send_dialog_alert(dialog.type, dialog.message)
+def with_memory(details, sampler):
+    """Append the run's peak memory to a status message (and print it)."""
+    summary = sampler.summary()
+    if not summary:
+        return details
+    print(f"Memory: {summary}")
+    return f"{details}\nMemory: {summary}"
 
-                time.sleep(15)  # Wait 15 seconds to let the user see the dialog
-                dialog.accept()  # or dialog.dismiss()
 
-            page.on('dialog', handle_dialog)
+def run_in_browser(p, headless, profile, url, round_choice, restored):
+    checkpoint("launch browser")
+    browser = launch_context(p, headless, profile)
+    try:
+        run_booking(browser, url, round_choice, restored)
+    finally:
+        # Always release the browser, including on cancellation
+        browser.close()
 
-            page.goto(url)
 
-            # Wait for the page to load and locate the label for the checkbox
-            page.wait_for_selector("label[for='cbxname1']")
+def page_stage(page):
+    """The ENTRY_STAGES stage the page shows right now, or None."""
+    for stage, selector in ENTRY_STAGES:
+        if page.locator(selector).count():
+            return stage
+    return None
 
-            # Click the label to select the checkbox
-            page.locator("label[for='cbxname1']").click()
 
-            # Wait a moment for JavaScript to execute after checkbox selection
-            page.wait_for_timeout(1000)
+def detect_entry_stage(page, restored=False):
+    """
+    Return the first STEP_ORDER step the current page expects. The page has loaded,
+    so a restored session that shows none of the steps was not let into the flow.
+    """
+    try:
+        page.wait_for_selector(", ".join(sel for _, sel in ENTRY_STAGES))
+    except PlaywrightTimeoutError:
+        if restored:
+            raise SessionRejected("no booking step found on the page")
+        raise
+    stage = page_stage(page)
+    if stage is None:
+        raise SessionRejected("no booking step found on the page")
+    return stage
+
+
+def run_booking(browser, url, round_choice=None, restored=False):
+    # `browser` is a Browser or, with a saved profile, a persistent BrowserContext
+    if getattr(browser, "pages", None):
+        page = browser.pages[0]
+    elif LOW_MEMORY:
+        page = browser.new_page(viewport=LOW_MEMORY_VIEWPORT)
+    else:
+        page = browser.new_page()
+    if LOW_MEMORY:
+        page.route("**/*", _block_heavy_resources)
+
+    # Handle dialogs
+    def handle_dialog(dialog):
+        print(f"Dialog type: {dialog.type}")
+        print(f"Dialog message: {dialog.message}")
+        print("Alert visible for 15 seconds...")
+
+        # Send dialog alert to Telegram
+        send_dialog_alert(dialog.type, dialog.message, wait=False)
+
+        # Wait 15 seconds to let the user see the dialog (cut short by a stop request)
+        _cancel_event.wait(15)
+        dialog.accept()  # or dialog.dismiss()
+
+    page.on('dialog', handle_dialog)
+
+    checkpoint("open booking page")
+    response = page.goto(url)
+    if response is not None and response.status >= 500:
+        # The site is failing, whatever the session; not a reason to drop the profile
+        raise RuntimeError(f"booking page returned HTTP {response.status}")
+
+    entry = detect_entry_stage(page, restored)
+    try:
+        if entry != STEP_ORDER[0]:
+            print(f"Session already past the first steps; resuming at '{entry}'")
+        steps = STEP_ORDER[STEP_ORDER.index(entry):]
+
+        if "select_prisoner" in steps:
+            select_prisoner(page)
+        if "enter_visitor_id" in steps:
+            enter_visitor_id(page)
+        if "confirm_prisoner" in steps:
+            confirm_prisoner(page)
+        if "add_visitor" in steps:
+            add_visitor(page)
+        select_slot(page, round_choice)
+    except PlaywrightTimeoutError as e:
+        # A session resumed past every page with the prisoner checkbox that shows it again
+        # was sent back to the start by the site. Nothing has been submitted yet, so it
+        # can safely be retried fresh; any other timeout is the site being slow.
+        if (restored and STEP_ORDER.index(entry) > STEP_ORDER.index("confirm_prisoner")
+                and page_stage(page) == "select_prisoner"):
+            raise SessionRejected(f"the site went back to the first step ({e})") from e
+        raise
 
-            # Wait for the submit button to be available
-            page.wait_for_selector("input.submit")
+    checkpoint("confirm booking")
+    # Click the confirm button
+    page.locator("input[value='ตกลง']").click()
 
-            # Click the submit button
-            page.locator("input.submit").click()
+    # Optionally, keep the browser open for a moment to see the result
+    page.wait_for_timeout(2000)  # Wait 2 seconds
 
-            # Wait for the input field to be available
-            page.wait_for_selector("#idno")
 
-            # Fill the input with the specified value
-            page.fill("#idno", ID_CARD1)
+def select_prisoner(page):
+    # Wait for the page to load and locate the label for the checkbox
+    page.wait_for_selector("label[for='cbxname1']")
 
-            # Wait for the submit button to be available
-            page.wait_for_selector("input.submit")
+    # Click the label to select the checkbox
+    page.locator("label[for='cbxname1']").click()
 
-            # Click the submit button
-            page.locator("input.submit").click()
+    # Wait a moment for JavaScript to execute after checkbox selection
+    page.wait_for_timeout(1000)
 
-                # Click the label to select the checkbox
-            page.locator("label[for='cbxname1']").click()
+    checkpoint("submit prisoner selection")
+    # Wait for the submit button to be available
+    page.wait_for_selector("input.submit")
 
+    # Click the submit button
+    page.locator("input.submit").click()
 
-             # Wait for the submit button to be available
-            page.wait_for_selector("input.submit")
 
-            # Click the submit button
-            page.locator("input.submit").click()
-            page.wait_for_selector("input.submit")
+def enter_visitor_id(page):
+    checkpoint("enter visitor ID")
+    # Wait for the input field to be available
+    page.wait_for_selector("#idno")
 
-            # Wait for the search input field to be available
-            page.wait_for_selector("#search_idno")
+    # Fill the input with the specified value
+    page.fill("#idno", ID_CARD1)
 
-            # Fill the search input with the specified value
-            page.fill("#search_idno", ID_CARD2)
-            page.locator("input[value='เพิ่ม']").click()
+    # Wait for the submit button to be available
+    page.wait_for_selector("input.submit")
 
+    # Click the submit button
+    page.locator("input.submit").click()
 
-            # Click the confirm button
-            page.locator("input[value='ตกลง']").click()
 
-            # Calculate the option value as tomorrow's day
-            tomorrow = datetime.now() + timedelta(days=1)
-            option_value = str(tomorrow.day)
-            print(f"Option value: {option_value}")
+def confirm_prisoner(page):
+    checkpoint("confirm prisoner")
+    # Click the label to select the checkbox
+    page.locator("label[for='cbxname1']").click()
 
-            # Wait for the round select to be available
-            page.wait_for_selector("#dd")
+    # Wait for the submit button to be available
+    page.wait_for_selector("input.submit")
 
-            # Select the option
-            page.select_option("#dd", option_value)
+    # Click the submit button
+    page.locator("input.submit").click()
+    page.wait_for_selector("input.submit")
 
-            # Click outside the select to trigger any JavaScript
-            page.locator("body").click()
-            page.wait_for_selector("#round")
-            # Use provided round_choice if given, otherwise fall back to '2'
-            sel_round = str(round_choice) if round_choice else '2'
-            page.select_option("#round", sel_round)
 
-            page.fill("#mobile", MOBILE)
-            page.locator("body").click()
-                   # Click the confirm button
-            page.locator("input[value='ตกลง']").click()
+def add_visitor(page):
+    checkpoint("add second visitor")
+    # Wait for the search input field to be available
+    page.wait_for_selector("#search_idno")
 
-            # Optionally, keep the browser open for a moment to see the result
-            page.wait_for_timeout(2000)  # Wait 2 seconds
+    # Fill the search input with the specified value
+    page.fill("#search_idno", ID_CARD2)
+    page.locator("input[value='เพิ่ม']").click()
 
-            # Send completion notification
-            send_automation_status("Completed", "VisitBRP automation finished successfully", round_choice=round_choice)
+    # Click the confirm button
+    page.locator("input[value='ตกลง']").click()
 
-            browser.close()
 
-    except Exception as e:
-        error_message = f"Automation failed with error: {str(e)}"
-        print(f"Error: {error_message}")
-        send_automation_status("Error", error_message, round_choice=round_choice)
-        raise
+def select_slot(page, round_choice=None):
+    checkpoint("select day")
+    # Calculate the option value as tomorrow's day
+    tomorrow = datetime.now() + timedelta(days=1)
+    option_value = str(tomorrow.day)
+    print(f"Option value: {option_value}")
+
+    # Wait for the round select to be available
+    page.wait_for_selector("#dd")
+
+    # Select the option
+    page.select_option("#dd", option_value)
+
+    # Click outside the select to trigger any JavaScript
+    page.locator("body").click()
+
+    checkpoint("select round")
+    page.wait_for_selector("#round")
+    # Use provided round_choice if given, otherwise fall back to '2'
+    sel_round = str(round_choice) if round_choice else '2'
+    page.select_option("#round", sel_round)
+
+    page.fill("#mobile", MOBILE)
+    page.locator("body").click()
+
 
 if __name__ == "__main__":
+    install_cancel_handlers()
     # Optional positional argument: round value (e.g. python main.py 2)
     arg = None
     if len(sys.argv) > 1:
         arg = sys.argv[1]
-    main(arg)
+    try:
+        main(arg)
+    except BookingCancelled:
+        sys.exit(EXIT_CANCELLED)
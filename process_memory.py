@@ -0,0 +1,147 @@
+"""
+Peak memory of a process and everything it started, sampled in the background.
+
+main.py wraps each booking in a PeakRssSampler so the Telegram result says how much
+memory the whole run took: the Python process, the Playwright driver and every
+Chromium process. Use it to decide how many bookings a device can run at once.
+
+Linux reads /proc directly (no extra dependency). Elsewhere `psutil` is used when it
+is installed; without it the sampler reports nothing.
+
+RSS counts shared pages (Chromium's shared libraries, shared memory) once per process,
+so the tree total is an upper bound on what the run really occupies.
+"""
+
+import os
+import threading
+
+try:
+    import psutil
+except ImportError:  # optional; only needed off Linux
+    psutil = None
+
+RSS_SAMPLE_INTERVAL_SEC = float(os.getenv("RSS_SAMPLE_INTERVAL_SEC") or 0.25)
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _proc_tree_rss(root_pid):
+    """(rss bytes, process count) for root_pid and its descendants, from /proc."""
+    children = {}
+    rss = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "rb") as fh:
+                fields = fh.read().rsplit(b")", 1)[1].split()
+        except OSError:
+            continue
+        if fields[0] == b"Z":
+            continue  # zombies hold no memory
+        pid = int(entry)
+        children.setdefault(int(fields[1]), []).append(pid)
+        # field 24 of stat (rss, in pages); index 21 after the comm field
+        rss[pid] = int(fields[21]) * _PAGE_SIZE
+
+    total, count = 0, 0
+    stack = [root_pid]
+    while stack:
+        pid = stack.pop()
+        if pid in rss:
+            total += rss[pid]
+            count += 1
+        stack.extend(children.get(pid, ()))
+    return total, count
+
+
+def _psutil_tree_rss(root_pid):
+    try:
+        root = psutil.Process(root_pid)
+        procs = [root] + root.children(recursive=True)
+    except psutil.Error:
+        return 0, 0
+    total, count = 0, 0
+    for proc in procs:
+        try:
+            total += proc.memory_info().rss
+            count += 1
+        except psutil.Error:
+            pass
+    return total, count
+
+
+def tree_rss(root_pid=None):
+    """(rss bytes, process count) of a process tree, or None if it cannot be measured."""
+    root_pid = os.getpid() if root_pid is None else root_pid
+    if os.path.isdir("/proc"):
+        return _proc_tree_rss(root_pid)
+    if psutil is not None:
+        return _psutil_tree_rss(root_pid)
+    return None
+
+
+def format_mb(num_bytes):
+    return f"{num_bytes / (1024 * 1024):.0f} MB"
+
+
+class PeakRssSampler:
+    """
+    Background thread recording the peak RSS of a process tree.
+
+        with PeakRssSampler() as sampler:
+            ...
+        print(sampler.summary())
+    """
+
+    def __init__(self, root_pid=None, interval=RSS_SAMPLE_INTERVAL_SEC):
+        self.root_pid = os.getpid() if root_pid is None else root_pid
+        self.interval = interval
+        self.peak_bytes = 0
+        self.peak_procs = 0  # process count at the peak
+        self.max_procs = 0
+        self.samples = 0
+        self.available = tree_rss(self.root_pid) is not None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        measured = tree_rss(self.root_pid)
+        if measured is None:
+            return
+        total, count = measured
+        self.samples += 1
+        if total > self.peak_bytes:
+            self.peak_bytes, self.peak_procs = total, count
+        self.max_procs = max(self.max_procs, count)
+
+    def start(self):
+        if self.available:
+            self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            self.sample()
+            if self._stop.wait(self.interval):
+                break
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def summary(self):
+        """One-line report for logs and the Telegram result, or "" when not measured."""
+        if not self.samples:
+            return ""
+        return (f"peak RSS {format_mb(self.peak_bytes)} across {self.peak_procs} processes"
+                f" (max {self.max_procs} processes)")
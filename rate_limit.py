@@ -0,0 +1,56 @@
+"""
+Small token-bucket rate limiter shared by the Telegram notifier and listener.
+
+A bucket holds up to `capacity` tokens and refills at `rate` tokens per second.
+In any window of T seconds at most `capacity + rate * T` tokens can be taken, so
+pick `capacity` with the hard limit in mind (e.g. rate 25/s + capacity 5 never
+exceeds Telegram's ~30 messages in a second).
+"""
+
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def delay(self, now=None):
+        """Seconds until one token is available (0.0 if it is available now)."""
+        now = self._clock() if now is None else now
+        with self._lock:
+            self._refill(now)
+            wait = 0.0 if self._tokens >= 1.0 else (1.0 - self._tokens) / self.rate
+            return max(wait, self._blocked_until - now)
+
+    def try_take(self, now=None):
+        """Take one token if available; return True on success."""
+        now = self._clock() if now is None else now
+        with self._lock:
+            self._refill(now)
+            if now < self._blocked_until or self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            return True
+
+    def block(self, seconds, now=None):
+        """Refuse tokens for `seconds` (e.g. after a 429 with retry_after) and empty the bucket."""
+        now = self._clock() if now is None else now
+        with self._lock:
+            self._refill(now)
+            self._tokens = 0.0
+            self._blocked_until = max(self._blocked_until, now + seconds)
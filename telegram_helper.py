@@ -1,43 +1,284 @@
+import heapq
+import itertools
+import threading
+import time
+
 import requests
-from config import TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID, TELEGRAM_CHAT_IDS
+from config import (TELEGRAM_API_BASE, TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID, TELEGRAM_CHAT_IDS,
+                    TELEGRAM_CHAT_RATE, TELEGRAM_GLOBAL_BURST, TELEGRAM_GLOBAL_RATE,
+                    TELEGRAM_RATE_SHARE, TELEGRAM_SEND_WORKERS)
 from datetime import datetime
+from rate_limit import TokenBucket
+
+# Priority classes for outgoing messages (lower value is sent first)
+PRIORITY_ALERT = 0   # dialog alerts and booking results
+PRIORITY_STATUS = 1  # other status updates
+PRIORITY_ACK = 2     # acknowledgements of chat commands
+
+MAX_SEND_ATTEMPTS = 5
+
+
+class _Delivery:
+    """Outcome of one send_telegram_message call across all of its chat ids."""
+
+    def __init__(self, count):
+        self.ok_any = False
+        self._remaining = count
+        self._done = threading.Event()
+        if count == 0:
+            self._done.set()
+
+    def _finish(self, ok):
+        self.ok_any = self.ok_any or ok
+        self._remaining -= 1
+        if self._remaining <= 0:
+            self._done.set()
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self.ok_any
+
+
+class TelegramDispatcher:
+    """
+    Paced fan-out of sendMessage calls.
+
+    Every (chat, message) pair is queued by priority and handed to a small pool of
+    sender threads only when both the global bucket and that chat's bucket have a
+    token, so a busy chat never holds up the others and the Bot API limits are not
+    exceeded. Each chat has at most one request in flight. A 429 blocks the chat for
+    `retry_after` seconds and requeues the message instead of dropping it.
+
+    The limits only cover this process; see TELEGRAM_RATE_SHARE in config.py for how
+    the listener and main.py split them.
+
+    Messages are kept in one heap per chat, so picking the next send costs
+    O(number of chats) however long the backlog grows.
+    """
+
+    def __init__(self, url, global_rate=TELEGRAM_GLOBAL_RATE, global_burst=TELEGRAM_GLOBAL_BURST,
+                 chat_rate=TELEGRAM_CHAT_RATE, workers=TELEGRAM_SEND_WORKERS):
+        self.url = url
+        self.chat_rate = chat_rate
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chats = {}
+        self._busy_chats = set()  # chats with a request in flight
+        # chat_id -> heap of (priority, seq, chat_id, text, enqueued_at, attempts, delivery);
+        # seq is unique, so entries never compare beyond the first two fields
+        self._queues = {}
+        self._queued = 0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._sent = 0
+        self._failed = 0
+        self._rate_limited = 0
+        self._delay_total = 0.0
+        self._delay_max = 0.0
+        self._last_delay = 0.0
+        for i in range(max(1, workers)):
+            threading.Thread(target=self._worker, name=f"telegram-send-{i}",
+                             daemon=True).start()
+
+    def submit(self, chat_ids, text, priority=PRIORITY_STATUS):
+        delivery = _Delivery(len(chat_ids))
+        now = time.monotonic()
+        with self._cond:
+            for cid in chat_ids:
+                self._push((priority, next(self._seq), str(cid), text, now, 0, delivery))
+            self._cond.notify_all()
+        return delivery
+
+    def flush(self, timeout=None):
+        """Wait until nothing is queued or in flight; True if that happened in time."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._queued or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def stats(self):
+        """Queue depth and send-delay figures (delays in seconds, enqueue to accepted)."""
+        with self._cond:
+            return {
+                "queue_depth": self._queued + self._in_flight,
+                "sent": self._sent,
+                "failed": self._failed,
+                "rate_limited": self._rate_limited,
+                "avg_delay": self._delay_total / self._sent if self._sent else 0.0,
+                "max_delay": self._delay_max,
+                "last_delay": self._last_delay,
+            }
+
+    def _bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, 1)
+        return bucket
+
+    def _push(self, entry):
+        heapq.heappush(self._queues.setdefault(entry[2], []), entry)
+        self._queued += 1
+
+    def _next(self):
+        """Block until some queued message may be sent now, then pop and return it."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = None
+                if self._queued:
+                    wait = self._global.delay(now)
+                    if wait <= 0:
+                        # Highest priority head among chats that are not being paced
+                        wait = None
+                        best = None
+                        for chat_id, heap in self._queues.items():
+                            if chat_id in self._busy_chats:
+                                continue  # woken again when that send completes
+                            chat_wait = self._bucket(chat_id).delay(now)
+                            if chat_wait > 0:
+                                wait = chat_wait if wait is None else min(wait, chat_wait)
+                            elif best is None or heap[0][:2] < self._queues[best][0][:2]:
+                                best = chat_id
+                        if best is not None and self._global.try_take(now):
+                            self._bucket(best).try_take(now)
+                            heap = self._queues[best]
+                            entry = heapq.heappop(heap)
+                            if not heap:
+                                del self._queues[best]
+                            self._queued -= 1
+                            self._busy_chats.add(best)
+                            self._in_flight += 1
+                            return entry
+                        if best is not None:
+                            wait = 0.0
+                self._cond.wait(None if wait is None else max(wait, 0.001))
+
+    def _worker(self):
+        session = requests.Session()
+        while True:
+            entry = self._next()
+            priority, seq, chat_id, text, enqueued_at, attempts, delivery = entry
+            ok = False
+            rate_limited = False
+            retry_after = None
+            try:
+                response = session.post(self.url, json={
+                    "chat_id": chat_id,
+                    "text": text,
+                    "parse_mode": "HTML"  # Allows basic HTML formatting
+                }, timeout=10)
+                if response.status_code == 200:
+                    ok = True
+                elif response.status_code == 429:
+                    rate_limited = True
+                    retry_after = 1.0
+                    try:
+                        parameters = response.json().get("parameters") or {}
+                        retry_after = float(parameters.get("retry_after", 1))
+                    except (ValueError, TypeError, AttributeError):
+                        pass  # malformed body; keep the default
+                else:
+                    print(f"❌ Failed to send to {chat_id}: {response.status_code}")
+                    print(f"Response: {response.text}")
+            except requests.exceptions.RequestException as e:
+                print(f"❌ Error sending message to {chat_id}: {e}")
+                retry_after = 1.0
+            except Exception as e:
+                # Anything unexpected fails this message only; the thread and chat live on
+                print(f"❌ Unexpected error sending message to {chat_id}: {e}")
+            finally:
+                self._complete(entry, ok, rate_limited, retry_after)
+
+    def _complete(self, entry, ok, rate_limited, retry_after):
+        """Bookkeeping after one send attempt: free the chat, then requeue or finish."""
+        priority, seq, chat_id, text, enqueued_at, attempts, delivery = entry
+        with self._cond:
+            self._in_flight -= 1
+            self._busy_chats.discard(chat_id)
+            # Pace the chat from when Telegram answered, not from when we sent:
+            # requests can overtake each other in flight, responses cannot.
+            self._bucket(chat_id).block(1.0 / self.chat_rate)
+            if rate_limited:
+                self._rate_limited += 1
+            if retry_after is not None and attempts + 1 < MAX_SEND_ATTEMPTS:
+                self._bucket(chat_id).block(retry_after)
+                self._push((priority, seq, chat_id, text, enqueued_at,
+                            attempts + 1, delivery))
+                self._cond.notify_all()
+                return
+            if ok:
+                delay = time.monotonic() - enqueued_at
+                self._sent += 1
+                self._delay_total += delay
+                self._delay_max = max(self._delay_max, delay)
+                self._last_delay = delay
+            else:
+                self._failed += 1
+            delivery._finish(ok)
+            self._cond.notify_all()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher(rate_share=TELEGRAM_RATE_SHARE):
+    """
+    Return the process-wide TelegramDispatcher, starting it on first use with
+    `rate_share` of the configured limits (later calls cannot change it).
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = TelegramDispatcher(
+                f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}/sendMessage",
+                global_rate=TELEGRAM_GLOBAL_RATE * rate_share,
+                global_burst=max(1.0, TELEGRAM_GLOBAL_BURST * rate_share),
+                chat_rate=TELEGRAM_CHAT_RATE * rate_share)
+        return _dispatcher
+
+
+def flush_telegram(timeout=None):
+    """Give queued messages up to `timeout` seconds to go out (e.g. before exiting)."""
+    with _dispatcher_lock:
+        dispatcher = _dispatcher
+    return dispatcher.flush(timeout) if dispatcher is not None else True
 
 
-def send_telegram_message(message):
+def send_telegram_message(message, priority=PRIORITY_STATUS, wait=True, timeout=None,
+                          chat_ids=None):
     """
     Send a message to Telegram bot
 
     Args:
         message (str): The message to send
+        priority (int): PRIORITY_ALERT, PRIORITY_STATUS or PRIORITY_ACK
+        wait (bool): Block until every chat has been tried; if False, only queue it
+        timeout (float, optional): Longest time to wait when `wait` is True
+        chat_ids (list, optional): Send only to these chats instead of all configured ones
 
     Returns:
-        bool: True if message sent successfully, False otherwise
+        bool: True if message sent (or queued, when wait=False) successfully, False otherwise
     """
     try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-        chat_ids = TELEGRAM_CHAT_IDS if TELEGRAM_CHAT_IDS else (
-            [TELEGRAM_CHAT_ID] if TELEGRAM_CHAT_ID else [])
+        if chat_ids is None:
+            chat_ids = TELEGRAM_CHAT_IDS if TELEGRAM_CHAT_IDS else (
+                [TELEGRAM_CHAT_ID] if TELEGRAM_CHAT_ID else [])
 
         # If no chat ids configured, log and skip
         if not chat_ids:
             print("ℹ️ No TELEGRAM_CHAT_ID(S) configured; skipping send.")
             return False
 
-        ok_any = False
-        for cid in chat_ids:
-            payload = {
-                "chat_id": cid,
-                "text": message,
-                "parse_mode": "HTML"  # Allows basic HTML formatting
-            }
-            response = requests.post(url, json=payload, timeout=10)
-            if response.status_code == 200:
-                ok_any = True
-            else:
-                print(f"❌ Failed to send to {cid}: {response.status_code}")
-                print(f"Response: {response.text}")
+        delivery = get_dispatcher().submit(chat_ids, message, priority)
+        if not wait:
+            return True
 
-        if ok_any:
+        if delivery.wait(timeout):
             print("✅ Message sent to Telegram successfully")
             return True
         return False
@@ -47,19 +288,12 @@ def send_telegram_message(message):
         return False
 
 
-def send_dialog_alert(dialog_type, dialog_message, timestamp=None):
-    """
-    Send a formatted dialog alert to Telegram
-
-    Args:
-        dialog_type (str): Type of dialog (alert, confirm, etc.)
-        dialog_message (str): The dialog message
-        timestamp (datetime, optional): When the dialog occurred
-    """
+def format_dialog_alert(dialog_type, dialog_message, timestamp=None):
+    """Build the HTML text of a dialog alert (see send_dialog_alert)."""
     if timestamp is None:
         timestamp = datetime.now()
 
-    formatted_message = f"""
+    return f"""
 🚨 <b>VisitBRP Dialog Alert</b>
 
 <b>Type:</b> {dialog_type}
@@ -69,27 +303,37 @@ def send_dialog_alert(dialog_type, dialog_message, timestamp=None):
 <i>Automation is handling this dialog...</i>
     """.strip()
 
-    return send_telegram_message(formatted_message)
 
-
-def send_automation_status(status, details="", round_choice=None):
+def send_dialog_alert(dialog_type, dialog_message, timestamp=None, wait=True, timeout=None):
     """
-    Send automation status updates to Telegram
+    Send a formatted dialog alert to Telegram
 
     Args:
-        status (str): Status message (e.g., "Started", "Completed", "Error")
-        details (str): Additional details
+        dialog_type (str): Type of dialog (alert, confirm, etc.)
+        dialog_message (str): The dialog message
+        timestamp (datetime, optional): When the dialog occurred
+        wait, timeout: as for send_telegram_message
     """
-    timestamp = datetime.now()
+    formatted_message = format_dialog_alert(
+        dialog_type, dialog_message, timestamp)
+    return send_telegram_message(formatted_message, priority=PRIORITY_ALERT,
+                                 wait=wait, timeout=timeout)
+
 
-    status_emoji = {
-        "started": "🚀",
-        "completed": "✅",
-        "error": "❌",
-        "warning": "⚠️"
-    }
+STATUS_EMOJI = {
+    "started": "🚀",
+    "completed": "✅",
+    "error": "❌",
+    "warning": "⚠️"
+}
 
-    emoji = status_emoji.get(status.lower(), "ℹ️")
+
+def format_automation_status(status, details="", round_choice=None, timestamp=None):
+    """Build the HTML text of a status update (see send_automation_status)."""
+    if timestamp is None:
+        timestamp = datetime.now()
+
+    emoji = STATUS_EMOJI.get(status.lower(), "ℹ️")
 
     message = f"""
 {emoji} <b>VisitBRP Automation</b>
@@ -104,4 +348,21 @@ def send_automation_status(status, details="", round_choice=None):
     if details:
         message += f"<b>Details:</b> {details}\n"
 
-    return send_telegram_message(message.strip())
+    return message.strip()
+
+
+def send_automation_status(status, details="", round_choice=None, wait=True, timeout=None):
+    """
+    Send automation status updates to Telegram
+
+    Args:
+        status (str): Status message (e.g., "Started", "Completed", "Error")
+        details (str): Additional details
+        wait, timeout: as for send_telegram_message
+    """
+    message = format_automation_status(status, details, round_choice)
+
+    # Booking results jump the queue ahead of command acknowledgements
+    priority = PRIORITY_ALERT if status.lower() in (
+        "completed", "error") else PRIORITY_STATUS
+    return send_telegram_message(message, priority=priority, wait=wait, timeout=timeout)
@@ -6,9 +6,15 @@ Usage:
 
 Behavior:
 - Long-polls Telegram getUpdates for new messages.
-- When a message is received from the configured chat ID (or any if TELEGRAM_CHAT_ID is empty),
-  it sends an acknowledgement and starts `main.py` in a separate Python subprocess.
+- When /start (or "start", "run") is received from the configured chat ID (or any if
+  TELEGRAM_CHAT_ID is empty), it sends an acknowledgement and starts `main.py` in a
+  separate Python subprocess. Other text gets a help reply unless TEXT_STARTS_RUN=1.
 - Prevents multiple concurrent automation runs.
+- Commands are looked up in a table (COMMANDS). Each chat and all chats together
+  have a command budget (token buckets); extra commands are dropped. Identical
+  start requests within START_DEDUP_WINDOW_SEC are merged into one job while it is
+  still queued or running. /status
+  reports the handled/merged/dropped counts.
 
 Notes:
 - Configure your bot token and chat id in `config.py` as before.
@@ -20,10 +26,12 @@ import sys
 import subprocess
 import requests
 import os
+import signal
 from typing import Optional
 
 try:
-    from config import TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID, TELEGRAM_CHAT_IDS
+    from config import (TELEGRAM_API_BASE, TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID, TELEGRAM_CHAT_IDS,
+                        TELEGRAM_RATE_SHARE, TELEGRAM_RUN_SHARE)
 except Exception as e:
     # Config may raise a RuntimeError when required env vars are missing.
     print("Configuration error while loading `config.py`:", str(e))
@@ -33,21 +41,74 @@ except Exception as e:
 
     sys.exit(1)
 
-from telegram_helper import send_telegram_message
+from telegram_helper import PRIORITY_ACK, PRIORITY_ALERT, get_dispatcher, send_telegram_message
+from coordination import COORD_DIR, INSTANCE_ID, FileLeaseStore, LeaseKeeper
+from rate_limit import TokenBucket
 import json
 import threading
+import uuid
+from collections import Counter
 from datetime import datetime, time as dt_time, date as dt_date
 
-GET_UPDATES_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getUpdates"
-PENDING_RUNS_FILE = os.path.join(
+GET_UPDATES_URL = f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}/getUpdates"
+# With COORD_DIR set (shared between instances) the queue lives there so every worker sees it
+PENDING_RUNS_FILE = os.path.join(COORD_DIR, "pending_runs.json") if os.getenv("COORD_DIR") else os.path.join(
     os.path.dirname(__file__), "pending_runs.json")
 # Default schedule time when queued jobs should be launched (09:30 local server time)
 SCHEDULE_HOUR = 9
 SCHEDULE_MINUTE = 30
 SCHEDULER_WAKE_SEC = 30  # how often scheduler checks the queue
-
-# Shared process handle for the currently running automation (module scope)
+# Set AVAILABILITY_WATCH=1 to also launch bookings as soon as the round opens (availability_watcher.py)
+AVAILABILITY_WATCH = os.getenv("AVAILABILITY_WATCH", "0") == "1"
+STOP_GRACE_SEC = 10  # how long /stop waits for the run to abort on its own
+STOP_KILL_TIMEOUT_SEC = 5  # how long to wait for the process group after SIGKILL
+
+# Shared process handle for the currently running automation (module scope).
+# Hold proc_lock while checking/starting/stopping it so the update loop and the
+# scheduler never launch a second browser while another is still tearing down.
 current_proc = None
+proc_lock = threading.RLock()
+
+# Multi-instance coordination (coordination.py): only the holder of the poller lease
+# calls getUpdates; every instance acts as a booking worker and takes scheduled jobs
+# off the shared queue through one-shot claims, so no job is launched twice.
+POLLER_LEASE = "telegram-poller"
+OFFSET_KEY = "telegram-offset"
+# A new poller resumes from the stored offset only if the previous one was active this
+# recently (failover); after a longer outage it skips the backlog like a fresh start.
+OFFSET_RESUME_SEC = 120
+CLAIM_RETENTION_SEC = 3 * 24 * 3600
+# Each instance publishes its running booking as a state entry "run-<instance>" so the
+# poller's /status and /stop can see it; /stop for another instance's run is passed on
+# as "stop-<instance>", which the owner checks every RUN_MONITOR_SEC.
+RUN_RECORD_PREFIX = "run-"
+STOP_REQUEST_PREFIX = "stop-"
+RUN_MONITOR_SEC = 1
+RUN_RECORD_REFRESH_SEC = 5
+RUN_RECORD_MAX_AGE_SEC = 15  # records of crashed instances disappear after this
+STOP_REQUEST_MAX_AGE_SEC = 60
+# Round main.py books when none is given (same default as WATCH_ROUND)
+DEFAULT_ROUND = "2"
+# Held while checking the run records and starting a run, so two instances never both
+# see "nothing running" and start at the same time
+RUN_START_MUTEX = "run-start"
+coord_store = FileLeaseStore(COORD_DIR)
+poller_lease = LeaseKeeper(coord_store, POLLER_LEASE)
+
+# Chats allowed to send commands, resolved once (empty: any chat)
+ALLOWED_CHAT_IDS = frozenset(str(cid) for cid in TELEGRAM_CHAT_IDS if cid)
+# Commands accepted per chat and from all chats together; extra commands are dropped
+COMMAND_CHAT_RATE = float(os.getenv("COMMAND_CHAT_RATE") or 0.5)
+COMMAND_CHAT_BURST = float(os.getenv("COMMAND_CHAT_BURST") or 5)
+COMMAND_GLOBAL_RATE = float(os.getenv("COMMAND_GLOBAL_RATE") or 10)
+COMMAND_GLOBAL_BURST = float(os.getenv("COMMAND_GLOBAL_BURST") or 30)
+# Identical start requests (same round, same queue/now decision) within this window,
+# from any chat, are merged into the first one while its job is still queued or running
+START_DEDUP_WINDOW_SEC = float(os.getenv("START_DEDUP_WINDOW_SEC") or 60)
+# Per-chat command budgets kept in memory; idle ones are forgotten beyond this many
+MAX_TRACKED_CHATS = 1024
+# Plain (non-command) text only starts a run with TEXT_STARTS_RUN=1; otherwise it gets help
+TEXT_STARTS_RUN = os.getenv("TEXT_STARTS_RUN", "0") == "1"
 
 
 def fetch_updates(offset: Optional[int] = None, timeout: int = 20):
@@ -67,6 +128,8 @@ def fetch_updates(offset: Optional[int] = None, timeout: int = 20):
 def start_automation_subprocess(round_arg=None):
     """Start main.py in a separate Python subprocess and return the Popen object.
     If round_arg is provided it will be passed as a positional argument to main.py.
+    The child gets its own process group so stop_automation() can take down the
+    Playwright driver and Chromium processes along with it.
     """
     python_exe = sys.executable or "python"
     cmd = [python_exe, "main.py"]
@@ -74,10 +137,98 @@ def start_automation_subprocess(round_arg=None):
         cmd.append(str(round_arg))
     print(f"Starting automation using: {' '.join(cmd)}")
     # Use Popen so we don't block the listener; inherit stdout/stderr
-    proc = subprocess.Popen(cmd, cwd=".")
+    if os.name == "nt":
+        proc = subprocess.Popen(
+            cmd, cwd=".", creationflags=subprocess.CREATE_NEW_PROCESS_GROUP)
+    else:
+        proc = subprocess.Popen(cmd, cwd=".", start_new_session=True)
+    # Published by monitor_run_once() for /status on any instance
+    proc.round_arg = round_arg
+    proc.started_at = datetime.now().isoformat(timespec="seconds")
     return proc
 
 
+def _group_alive(proc):
+    """True while any process in the automation's process group still exists."""
+    if os.name == "nt":
+        return proc.poll() is None
+    if os.path.isdir("/proc"):
+        # Linux: ignore zombies, which killpg() still counts but hold no memory
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat", "rb") as fh:
+                    fields = fh.read().rsplit(b")", 1)[1].split()
+            except OSError:
+                continue
+            if int(fields[2]) == proc.pid and fields[0] != b"Z":
+                return True
+        return False
+    try:
+        os.killpg(proc.pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _kill_group(proc):
+    if os.name == "nt":
+        # /T takes the whole tree (Playwright driver and Chromium) down with it
+        subprocess.run(["taskkill", "/F", "/T", "/PID", str(proc.pid)],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    else:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+def stop_automation(proc, grace=STOP_GRACE_SEC, kill_timeout=STOP_KILL_TIMEOUT_SEC):
+    """
+    Stop a running automation and wait until its resources are released.
+
+    First asks main.py to abort at its next step boundary (it closes the browser
+    itself), then kills the whole process group if it is still around after
+    `grace` seconds. Returns (seconds until everything exited, how, released)
+    where how is "graceful" or "killed".
+    """
+    started = time.monotonic()
+    try:
+        if os.name == "nt":
+            proc.send_signal(signal.CTRL_BREAK_EVENT)
+        else:
+            proc.send_signal(signal.SIGTERM)
+    except (ProcessLookupError, OSError):
+        pass
+
+    how = "graceful"
+    try:
+        proc.wait(timeout=grace)
+    except subprocess.TimeoutExpired:
+        how = "killed"
+
+    # main.py may have exited while a browser child is still shutting down
+    deadline = time.monotonic() + max(0.0, grace - (time.monotonic() - started))
+    while _group_alive(proc) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    if _group_alive(proc):
+        how = "killed"
+        _kill_group(proc)
+        try:
+            proc.wait(timeout=kill_timeout)
+        except subprocess.TimeoutExpired:
+            pass
+        deadline = time.monotonic() + kill_timeout
+        while _group_alive(proc) and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    released = not _group_alive(proc)
+    return time.monotonic() - started, how, released
+
+
 def load_pending_runs():
     if not os.path.exists(PENDING_RUNS_FILE):
         return []
@@ -89,9 +240,12 @@ def load_pending_runs():
 
 
 def save_pending_runs(runs):
+    # Write-then-rename so other instances never read a half-written queue
+    tmp = f"{PENDING_RUNS_FILE}.{os.getpid()}.tmp"
     try:
-        with open(PENDING_RUNS_FILE, "w", encoding="utf-8") as fh:
+        with open(tmp, "w", encoding="utf-8") as fh:
             json.dump(runs, fh, ensure_ascii=False, indent=2)
+        os.replace(tmp, PENDING_RUNS_FILE)
     except Exception as e:
         print(f"Failed to save pending runs: {e}")
 
@@ -101,218 +255,613 @@ def schedule_run(chat_id, round_choice):
     now = datetime.now()
     # scheduled_for kept as ISO date string for simplicity
     sched_date = now.date().isoformat()
-    pending = load_pending_runs()
-    pending.append({
-        "chat_id": str(chat_id),
-        "round": str(round_choice) if round_choice is not None else None,
-        "requested_at": now.isoformat(),
-        "scheduled_for": sched_date,
-    })
-    save_pending_runs(pending)
+    with coord_store.mutex("pending-runs"):
+        pending = load_pending_runs()
+        pending.append({
+            "id": uuid.uuid4().hex,
+            "chat_id": str(chat_id),
+            "round": str(round_choice) if round_choice is not None else None,
+            "requested_at": now.isoformat(),
+            "scheduled_for": sched_date,
+        })
+        save_pending_runs(pending)
+    return pending[-1]["id"]
+
+
+def slot_key(round_choice, day=None):
+    """
+    Claim key for booking `round_choice` today. Every way of starting a booking
+    (scheduler, /start, availability watcher) claims it, so the watcher and the
+    queue never both book the same round on the same day.
+    """
+    day = day or datetime.now().date()
+    return f"slot-{day.isoformat()}-{round_choice or DEFAULT_ROUND}"
+
+
+def claim_due_job(today_str):
+    """Take the first job due today off the shared queue, claimed for this instance."""
+    with coord_store.mutex("pending-runs"):
+        pending = load_pending_runs()
+        remaining = []
+        claimed = None
+        for job in pending:
+            if claimed is None and job.get("scheduled_for") == today_str:
+                job_id = job.setdefault("id", uuid.uuid4().hex)
+                if coord_store.claim(job_id, INSTANCE_ID):
+                    claimed = job
+                # else: another worker already launched it; drop the stale entry
+                continue
+            remaining.append(job)
+        if len(remaining) != len(pending):
+            save_pending_runs(remaining)
+        return claimed
+
+
+def requeue_job(job):
+    """Put a claimed job back at the front of the queue (it could not be started)."""
+    coord_store.release_claim(job["id"])
+    with coord_store.mutex("pending-runs"):
+        pending = load_pending_runs()
+        pending.insert(0, job)
+        save_pending_runs(pending)
+
+
+def process_pending_runs_once(now=None):
+    """One scheduler tick: launch the next job due today if this instance is idle."""
+    now = now or datetime.now()
+    today_str = now.date().isoformat()
+    target_dt = datetime.combine(
+        now.date(), dt_time(SCHEDULE_HOUR, SCHEDULE_MINUTE))
+    if now >= target_dt:
+        with proc_lock:
+            # attempt to launch (respect current_proc concurrency)
+            proc = globals().get('current_proc')
+            try:
+                running = proc is not None and proc.poll() is None
+            except Exception:
+                running = False
+
+            # automation running here: leave due jobs for another worker or a later tick
+            job = None if running else claim_due_job(today_str)
+            if job is not None:
+                round_choice = job.get("round")
+                key = slot_key(round_choice, now.date())
+                if not coord_store.claim(key, INSTANCE_ID):
+                    # e.g. the availability watcher booked it as soon as the round opened
+                    msg = (f"Skipped the scheduled run (round={round_choice or DEFAULT_ROUND}): "
+                           "a booking for that round already started today.")
+                    print(msg)
+                    send_telegram_message(msg, wait=False)
+                    job = None
+            if job is not None:
+                try:
+                    print(
+                        f"Launching scheduled run (round={round_choice}) from pending queue")
+                    # Queued jobs may run side by side on several workers
+                    new_proc, _ = start_published_run(round_choice, exclusive=False)
+                    globals()['current_proc'] = new_proc
+                    send_telegram_message(
+                        f"Scheduled automation launched (round={round_choice}).", wait=False)
+                except Exception as e:
+                    print(f"Failed to launch scheduled job: {e}")
+                    # keep the job to try again later
+                    coord_store.release_claim(key)
+                    requeue_job(job)
+    coord_store.prune_claims(CLAIM_RETENTION_SEC)
 
 
 def process_pending_runs_loop():
     while True:
         try:
-            now = datetime.now()
-            today_str = now.date().isoformat()
-            target_dt = datetime.combine(
-                now.date(), dt_time(SCHEDULE_HOUR, SCHEDULE_MINUTE))
-            if now >= target_dt:
-                pending = load_pending_runs()
-                remaining = []
-                for job in pending:
-                    if job.get("scheduled_for") == today_str:
-                        # attempt to launch (respect current_proc concurrency)
-                        proc = globals().get('current_proc')
-                        try:
-                            running = proc is not None and proc.poll() is None
-                        except Exception:
-                            running = False
-
-                        if running:
-                            # automation running, keep job for later
-                            remaining.append(job)
-                            continue
-
-                        round_choice = job.get("round")
-                        try:
-                            print(
-                                f"Launching scheduled run (round={round_choice}) from pending queue")
-                            new_proc = start_automation_subprocess(
-                                round_choice)
-                            globals()['current_proc'] = new_proc
-                            send_telegram_message(
-                                f"Scheduled automation launched (round={round_choice}).")
-                        except Exception as e:
-                            print(f"Failed to launch scheduled job: {e}")
-                            # keep the job to try again later
-                            remaining.append(job)
-                    else:
-                        remaining.append(job)
-                save_pending_runs(remaining)
+            process_pending_runs_once()
         except Exception as e:
             print(f"Scheduler error: {e}")
         time.sleep(SCHEDULER_WAKE_SEC)
 
 
+_published_run = None  # (pid, monotonic time of the last write)
+# Other instances' run records as of the monitor's last pass, for /status, so
+# the command does not list COORD_DIR every time
+other_runs = []
+
+
+def publish_run(proc):
+    """Write (or refresh) this instance's run record for `proc`."""
+    global _published_run
+    coord_store.set_value(RUN_RECORD_PREFIX + INSTANCE_ID, {
+        "instance": INSTANCE_ID,
+        "pid": proc.pid,
+        "round": getattr(proc, "round_arg", None),
+        "started_at": getattr(proc, "started_at", None),
+    })
+    _published_run = (proc.pid, time.monotonic())
+
+
+def start_published_run(round_choice, exclusive=True):
+    """
+    Start main.py and publish its run record before any other instance can look.
+    With `exclusive`, nothing is started while another instance runs a booking.
+    Returns (proc, None), or (None, the other instance's run record).
+    """
+    with coord_store.mutex(RUN_START_MUTEX):
+        if exclusive:
+            others = running_elsewhere()
+            if others:
+                return None, others[0]
+        proc = start_automation_subprocess(round_choice)
+        publish_run(proc)
+        return proc, None
+
+
+def monitor_run_once():
+    """
+    Publish this instance's running booking, refresh `other_runs` and act on /stop
+    requests for this instance.
+    """
+    global current_proc, _published_run, other_runs
+    with proc_lock:
+        proc = current_proc
+        running = proc is not None and proc.poll() is None
+    now = time.monotonic()
+    if running:
+        if (_published_run is None or _published_run[0] != proc.pid
+                or now - _published_run[1] >= RUN_RECORD_REFRESH_SEC):
+            publish_run(proc)
+    elif _published_run is not None:
+        coord_store.delete_value(RUN_RECORD_PREFIX + INSTANCE_ID)
+        _published_run = None
+    other_runs = running_elsewhere()
+
+    request = coord_store.get_value(STOP_REQUEST_PREFIX + INSTANCE_ID,
+                                    max_age=STOP_REQUEST_MAX_AGE_SEC)
+    if request is None:
+        return
+    coord_store.delete_value(STOP_REQUEST_PREFIX + INSTANCE_ID)
+    with proc_lock:
+        proc = current_proc
+        if proc is None or proc.poll() is not None or proc.pid != request.get("pid"):
+            return  # that run has already ended
+        elapsed, how, released = stop_automation(proc)
+        current_proc = None
+    if released:
+        msg = f"Automation on {INSTANCE_ID} stopped in {elapsed:.1f}s ({how}); browser resources released."
+    else:
+        msg = f"Automation stop on {INSTANCE_ID} timed out after {elapsed:.1f}s; some browser processes may still be running."
+    print(msg)
+    send_telegram_message(msg, priority=PRIORITY_ALERT, wait=False)
+
+
+def monitor_runs_loop():
+    while True:
+        try:
+            monitor_run_once()
+        except Exception as e:
+            print(f"Run monitor error: {e}")
+        time.sleep(RUN_MONITOR_SEC)
+
+
+def running_elsewhere():
+    """Run records published by other instances (fresh ones only)."""
+    return [run for run in coord_store.list_values(RUN_RECORD_PREFIX,
+                                                   max_age=RUN_RECORD_MAX_AGE_SEC)
+            if run.get("instance") != INSTANCE_ID]
+
+
+def launch_for_available_slot(round_choice, snapshot):
+    """
+    AvailabilityWatcher hand-off: start a booking now unless one is already running.
+    Returns True once the slot is taken care of: this instance started the booking, or
+    one for the same round already started today (any instance, /start or the queue;
+    a queued job still waiting is skipped when it comes due). Returns False when a
+    booking for another round is running; the watcher retries then.
+    """
+    global current_proc
+    with proc_lock:
+        key = slot_key(round_choice)
+        if not coord_store.claim(key, INSTANCE_ID):
+            print("Slot opened but a booking for that round already started today.")
+            return True
+        if current_proc is not None and current_proc.poll() is None:
+            print("Slot opened but automation is already running.")
+            coord_store.release_claim(key)
+            return False
+        try:
+            proc, other = start_published_run(round_choice)
+            if other is not None:
+                print(f"Slot opened but automation is already running on {other['instance']}.")
+                coord_store.release_claim(key)
+                return False
+            current_proc = proc
+        except Exception as e:
+            # Give the slot back so this or another instance can try again
+            coord_store.release_claim(key)
+            err = f"Failed to start automation for the open slot: {e}"
+            print(err)
+            send_telegram_message(err, priority=PRIORITY_ALERT, wait=False)
+            return False
+        return True
+
+
+def send_ack(text, chat_id=None):
+    """
+    Queue a reply to a chat command without blocking the update loop.
+    With `chat_id` only that chat gets it, otherwise every configured chat.
+    """
+    return send_telegram_message(text, priority=PRIORITY_ACK, wait=False,
+                                 chat_ids=[chat_id] if chat_id is not None else None)
+
+
+# -- command dispatch ---------------------------------------------------------
+# The state below is only touched by the update loop (one thread).
+
+COMMANDS = {}  # command word -> (handler(chat_id, arg), throttled)
+command_stats = Counter()  # handled / merged / dropped_* / unauthorized / unknown
+command_global_bucket = TokenBucket(COMMAND_GLOBAL_RATE, COMMAND_GLOBAL_BURST)
+_chat_buckets = {}  # chat_id -> [TokenBucket, monotonic time last seen]
+_throttled_chats = set()  # chats already told to slow down
+# idempotency key -> (monotonic time accepted, pid of the run or id of the queued job)
+_recent_starts = {}
+
+
+def command(*words, throttled=True):
+    """Register a handler for the given command words (with and without the slash)."""
+    def register(handler):
+        for word in words:
+            COMMANDS[word] = (handler, throttled)
+        return handler
+    return register
+
+
+def _prune_chat_buckets(now):
+    """Forget chats whose bucket has refilled (same as a new one), or all if still too many."""
+    refill_sec = COMMAND_CHAT_BURST / COMMAND_CHAT_RATE
+    for chat_id, (_, last_seen) in list(_chat_buckets.items()):
+        if now - last_seen > refill_sec:
+            del _chat_buckets[chat_id]
+            _throttled_chats.discard(chat_id)
+    if len(_chat_buckets) >= MAX_TRACKED_CHATS:
+        # A burst from that many distinct chats is left to the global bucket
+        _chat_buckets.clear()
+        _throttled_chats.clear()
+
+
+def _admit(chat_id):
+    """Apply the per-chat and global command budgets; True if the command may run."""
+    now = time.monotonic()
+    entry = _chat_buckets.get(chat_id)
+    if entry is None:
+        if len(_chat_buckets) >= MAX_TRACKED_CHATS:
+            _prune_chat_buckets(now)
+        entry = _chat_buckets[chat_id] = [
+            TokenBucket(COMMAND_CHAT_RATE, COMMAND_CHAT_BURST), now]
+    entry[1] = now
+    if not entry[0].try_take(now):
+        command_stats["dropped_chat"] += 1
+        if chat_id not in _throttled_chats:
+            # Tell the sender (only) once per burst, not once per dropped command
+            _throttled_chats.add(chat_id)
+            send_ack("Too many commands; ignoring them for a few seconds.", chat_id)
+        return False
+    if not command_global_bucket.try_take(now):
+        command_stats["dropped_global"] += 1
+        return False
+    _throttled_chats.discard(chat_id)
+    return True
+
+
+def _start_still_active(key, ref):
+    """Whether the run or queued job created for an accepted start request is still there."""
+    if key[0] == "now":
+        proc = current_proc
+        return proc is not None and proc.pid == ref and proc.poll() is None
+    return any(job.get("id") == ref for job in load_pending_runs())
+
+
+def _merge_duplicate_start(key, chat_id):
+    """
+    True if an identical start request was accepted within START_DEDUP_WINDOW_SEC and
+    its job is still queued or running (a stopped, failed or cancelled one is not).
+    """
+    now = time.monotonic()
+    for old_key, (accepted_at, _) in list(_recent_starts.items()):
+        if now - accepted_at > START_DEDUP_WINDOW_SEC:
+            del _recent_starts[old_key]
+    recent = _recent_starts.get(key)
+    if recent is None:
+        return False
+    if not _start_still_active(key, recent[1]):
+        del _recent_starts[key]
+        return False
+    command_stats["merged"] += 1
+    send_ack(f"Same request received {now - recent[0]:.0f}s ago; "
+             "not starting another run.", chat_id)
+    return True
+
+
+def _start_now(chat_id, round_choice, replies):
+    """Launch main.py unless a run is in progress; returns True if it was started."""
+    global current_proc
+    key = ("now", round_choice)
+    if _merge_duplicate_start(key, chat_id):
+        return False
+    with proc_lock:
+        if current_proc is not None and current_proc.poll() is None:
+            reply = "Automation is already running."
+            print(reply)
+            send_ack(reply)
+            return False
+        try:
+            proc, other = start_published_run(round_choice)
+        except Exception as e:
+            err = f"Failed to start automation: {e}"
+            print(err)
+            send_ack(err)
+            return False
+        if other is not None:
+            reply = f"Automation is already running on {other['instance']}."
+            print(reply)
+            send_ack(reply)
+            return False
+        current_proc = proc
+        # Asked for explicitly, so it runs even if the slot was claimed; the claim
+        # keeps the watcher and the queue from booking this round again today
+        coord_store.claim(slot_key(round_choice), INSTANCE_ID)
+        send_ack(replies[0])
+        _recent_starts[key] = (time.monotonic(), current_proc.pid)
+        send_ack(replies[1])
+        return True
+
+
+@command("/start", "start", "run")
+def cmd_start(chat_id, arg):
+    # parse numeric arg if present
+    chosen_round = arg if (arg and arg.isdigit()) else None
+
+    # Decide whether to queue or run immediately based on schedule
+
+    # -Before 09:30 (e.g., 08:00 the same day chat ): queues for today at 09:30.
+    # -After 09:30 (e.g., 23:00 the same day chat): runs immediately.
+    # -After 09:30 (e.g., 10:00 the same day chat): runs immediately.
+
+    now = datetime.now()
+    target_dt = datetime.combine(
+        now.date(), dt_time(SCHEDULE_HOUR, SCHEDULE_MINUTE))
+
+    if now < target_dt:
+        key = ("queue", now.date().isoformat(), chosen_round)
+        if _merge_duplicate_start(key, chat_id):
+            return
+        # queue for today's scheduled time
+        job_id = schedule_run(chat_id, chosen_round)
+        _recent_starts[key] = (time.monotonic(), job_id)
+        reply = f"Received. I will run this automation at {SCHEDULE_HOUR:02d}:{SCHEDULE_MINUTE:02d} (round={chosen_round or 'default'})."
+        send_ack(reply)
+        return
+
+    # Inform user which round value will be used
+    _start_now(chat_id, chosen_round, (
+        f"Starting automation now (round={chosen_round or 'default'})...",
+        "Automation launched (background process). I'll notify you when it finishes."))
+
+
+@command("/pending", "pending")
+def cmd_pending(chat_id, arg):
+    pending = load_pending_runs()
+    if not pending:
+        send_ack("No pending scheduled runs.")
+    else:
+        lines = ["Pending scheduled runs:"]
+        for i, job in enumerate(pending, start=1):
+            lines.append(
+                f"{i}. scheduled_for={job.get('scheduled_for')} round={job.get('round') or 'default'} requested_at={job.get('requested_at')}")
+        send_ack("\n".join(lines))
+
+
+@command("/cancel", "cancel")
+def cmd_cancel(chat_id, arg):
+    # cancel by 1-based index: /cancel 1
+    if arg and arg.isdigit():
+        idx = int(arg) - 1
+        with coord_store.mutex("pending-runs"):
+            pending = load_pending_runs()
+            job = pending.pop(idx) if 0 <= idx < len(pending) else None
+            if job is not None:
+                save_pending_runs(pending)
+        if job is not None:
+            send_ack(
+                f"Cancelled pending run {idx+1} (round={job.get('round') or 'default'}).")
+        else:
+            send_ack(
+                f"Invalid index. There are {len(pending)} pending jobs.")
+    else:
+        send_ack(
+            "Usage: /cancel N  (where N is the job number from /pending)")
+
+
+@command("/status", "status")
+def cmd_status(chat_id, arg):
+    if current_proc is not None and current_proc.poll() is None:
+        state = "Automation is currently running."
+    else:
+        state = "No automation is running right now."
+    state += f" (instance {INSTANCE_ID})"
+    for run in other_runs:
+        state += (f"\nAlso running on {run['instance']}: pid {run['pid']}, "
+                  f"round={run.get('round') or 'default'}, since {run.get('started_at')}.")
+    stats = get_dispatcher().stats()
+    dropped = command_stats["dropped_chat"] + command_stats["dropped_global"]
+    send_ack(
+        f"{state}\nNotifier queue: {stats['queue_depth']} pending, "
+        f"send delay avg {stats['avg_delay']:.1f}s / max {stats['max_delay']:.1f}s.\n"
+        f"Commands: {command_stats['handled']} handled, {command_stats['merged']} merged, "
+        f"{dropped} dropped.")
+
+
+# Never throttled: stopping a run must always get through
+@command("/stop", "stop", throttled=False)
+def cmd_stop(chat_id, arg):
+    global current_proc
+    # Stop synchronously (bounded by STOP_GRACE_SEC + STOP_KILL_TIMEOUT_SEC) so a
+    # following /start never overlaps with a browser that is still shutting down.
+    with proc_lock:
+        if current_proc is not None and current_proc.poll() is None:
+            send_ack("Stopping the automation...")
+            elapsed, how, released = stop_automation(current_proc)
+            current_proc = None
+            if released:
+                send_ack(
+                    f"Automation stopped in {elapsed:.1f}s ({how}); browser resources released.")
+            else:
+                send_ack(
+                    f"Automation stop timed out after {elapsed:.1f}s; some browser processes may still be running.")
+            return
+    # Not running here: ask the worker instances that are running one
+    others = running_elsewhere()
+    for run in others:
+        coord_store.set_value(STOP_REQUEST_PREFIX + run["instance"],
+                              {"pid": run["pid"], "requested_by": INSTANCE_ID})
+        send_ack(f"Asked {run['instance']} to stop its automation (pid {run['pid']}); "
+                 "it will report back.")
+    if not others:
+        send_ack(
+            "No running automation process to stop.")
+
+
+COMMAND_HELP = "Commands: /start [round], /pending, /cancel N, /status, /stop."
+
+
+def handle_text(chat_id, text):
+    """Plain (non-command) text: help, or an immediate start with TEXT_STARTS_RUN=1."""
+    if not TEXT_STARTS_RUN:
+        send_ack(f"Not a command. {COMMAND_HELP}", chat_id)
+        return
+    _start_now(chat_id, None, ("Message received — starting automation now...",
+                               "Automation launched (background process)."))
+
+
+def handle_update(update):
+    """Handle a single getUpdates entry: filter by chat and run the matching command."""
+    message = update.get("message") or update.get("edited_message")
+    if not message:
+        return
+
+    chat = message.get("chat", {})
+    chat_id = str(chat.get("id"))
+    text = message.get("text", "")
+
+    print(f"Received message from chat {chat_id}: {text}")
+
+    # If any allowed ids configured and chat is not in the set, ignore
+    if ALLOWED_CHAT_IDS and chat_id not in ALLOWED_CHAT_IDS:
+        command_stats["unauthorized"] += 1
+        print(f"Ignoring message from unknown chat {chat_id}")
+        return
+
+    tokens = text.split()
+    if not tokens:
+        return
+    cmd_word = tokens[0].lower()
+    cmd_arg = tokens[1] if len(tokens) > 1 else None
+
+    handler, throttled = COMMANDS.get(cmd_word, (None, True))
+    if throttled and not _admit(chat_id):
+        print(f"Dropping command from chat {chat_id} (rate limited)")
+        return
+    command_stats["handled"] += 1
+
+    if handler is not None:
+        handler(chat_id, cmd_arg)
+    elif cmd_word.startswith("/"):
+        command_stats["unknown"] += 1
+        send_ack(f"Unknown command. {COMMAND_HELP}", chat_id)
+    else:
+        handle_text(chat_id, text)
+
+
 def main():
     print("Telegram listener starting...")
+    # main.py runs send through their own dispatcher with TELEGRAM_RUN_SHARE of the limits
+    get_dispatcher(TELEGRAM_RATE_SHARE * (1 - TELEGRAM_RUN_SHARE))
     # start background scheduler thread
     scheduler_thread = threading.Thread(
         target=process_pending_runs_loop, daemon=True)
     scheduler_thread.start()
-    # On startup, fetch any pending updates and advance the offset so we don't
-    # immediately process old messages that were sent before the listener started.
-    last_update_id = None
-    try:
-        pending = fetch_updates(timeout=1)
-        if pending:
-            last_update_id = pending[-1].get("update_id")
-            print(
-                f"Found {len(pending)} pending update(s). Ignoring backlog up to update_id {last_update_id}.")
-            print("If you want to process past messages instead, remove this startup-skip logic or run clear_updates.py first.")
-    except Exception as e:
-        print(f"Warning: failed to inspect pending updates on startup: {e}")
-        last_update_id = None
+    threading.Thread(target=monitor_runs_loop, daemon=True).start()
+    if AVAILABILITY_WATCH:
+        # Imported lazily so the listener does not depend on it unless enabled
+        from availability_watcher import AvailabilityWatcher
+        try:
+            watcher = AvailabilityWatcher(launch_for_available_slot)
+        except ValueError as e:
+            print(f"ERROR: AVAILABILITY_WATCH=1 but the watcher cannot run: {e}")
+            send_telegram_message(f"⚠️ Availability watcher disabled: {e}",
+                                  priority=PRIORITY_ALERT, wait=False)
+        else:
+            threading.Thread(target=watcher.run, daemon=True).start()
     global current_proc
     current_proc = None
 
+    poller_lease.start()
+    last_update_id = None
+    polling = False
+
     while True:
+        if not poller_lease.held:
+            if polling:
+                print("Lost the poller lease; another instance is polling Telegram now.")
+                polling = False
+            else:
+                print(f"Standing by as booking worker ({INSTANCE_ID}); waiting for the poller lease...")
+            poller_lease.wait_held()
+            continue
+
+        if not polling:
+            polling = True
+            # Resume from the offset the previous poller confirmed, if it was active recently
+            last_update_id = coord_store.get_value(
+                OFFSET_KEY, max_age=OFFSET_RESUME_SEC)
+            if last_update_id is None:
+                last_update_id = skip_backlog()
+            print(f"Polling Telegram as {INSTANCE_ID} (last update_id {last_update_id}).")
+
         updates = fetch_updates(
             offset=(last_update_id + 1) if last_update_id is not None else None, timeout=30)
+        # Doubles as a heartbeat for OFFSET_RESUME_SEC. The long poll may have outlasted
+        # our lease; a stale write would rewind the new poller's offset.
+        if last_update_id is not None and poller_lease.held:
+            coord_store.set_value(OFFSET_KEY, last_update_id)
 
         for update in updates:
+            if not poller_lease.held:
+                # Leave the rest unconfirmed; the next poller fetches them again
+                break
             last_update_id = update.get("update_id", last_update_id)
+            # Record before handling so a failover never handles this update twice
+            coord_store.set_value(OFFSET_KEY, last_update_id)
 
-            message = update.get("message") or update.get("edited_message")
-            if not message:
-                continue
-
-            chat = message.get("chat", {})
-            chat_id = str(chat.get("id"))
-            text = message.get("text", "")
-
-            print(f"Received message from chat {chat_id}: {text}")
-
-            # Accept messages based on configured chat ids
-            allowed_ids = set(TELEGRAM_CHAT_IDS) if 'TELEGRAM_CHAT_IDS' in globals() and TELEGRAM_CHAT_IDS else (
-                {str(TELEGRAM_CHAT_ID)} if TELEGRAM_CHAT_ID else set()
-            )
-            # If any allowed ids configured and chat is not in the set, ignore
-            if allowed_ids and chat_id not in allowed_ids:
-                print(f"Ignoring message from unknown chat {chat_id}")
-                continue
-
-            # Simple commands
-            tokens = text.strip().split() if text else []
-            cmd_word = tokens[0].lower() if tokens else None
-            cmd_arg = tokens[1] if len(tokens) > 1 else None
-
-            if cmd_word and cmd_word in ("/start", "start", "run"):
-                # parse numeric arg if present
-                chosen_round = cmd_arg if (
-                    cmd_arg and cmd_arg.isdigit()) else None
-
-                # Decide whether to queue or run immediately based on schedule
-
-                # -Before 09:30 (e.g., 08:00 the same day chat ): queues for today at 09:30.
-                # -After 09:30 (e.g., 23:00 the same day chat): runs immediately.
-                # -After 09:30 (e.g., 10:00 the same day chat): runs immediately.
-
-                now = datetime.now()
-                target_dt = datetime.combine(
-                    now.date(), dt_time(SCHEDULE_HOUR, SCHEDULE_MINUTE))
-
-                if now < target_dt:
-                    # queue for today's scheduled time
-                    schedule_run(chat_id, chosen_round)
-                    reply = f"Received. I will run this automation at {SCHEDULE_HOUR:02d}:{SCHEDULE_MINUTE:02d} (round={chosen_round or 'default'})."
-                    send_telegram_message(reply)
-                else:
-                    if current_proc is not None and current_proc.poll() is None:
-                        reply = "Automation is already running."
-                        print(reply)
-                        send_telegram_message(reply)
-                    else:
-                        # Inform user which round value will be used
-                        if chosen_round:
-                            reply = f"Starting automation now (round={chosen_round})..."
-                            current_proc = start_automation_subprocess(
-                                chosen_round)
-                        else:
-                            reply = "Starting automation now (round=default)..."
-                            current_proc = start_automation_subprocess()
-                        send_telegram_message(reply)
-                        send_telegram_message(
-                            "Automation launched (background process). I'll notify you when it finishes.")
-
-            elif cmd_word and cmd_word in ("/pending", "pending"):
-                pending = load_pending_runs()
-                if not pending:
-                    send_telegram_message("No pending scheduled runs.")
-                else:
-                    lines = ["Pending scheduled runs:"]
-                    for i, job in enumerate(pending, start=1):
-                        lines.append(
-                            f"{i}. scheduled_for={job.get('scheduled_for')} round={job.get('round') or 'default'} requested_at={job.get('requested_at')}")
-                    send_telegram_message("\n".join(lines))
-
-            elif cmd_word and cmd_word in ("/cancel", "cancel"):
-                # cancel by 1-based index: /cancel 1
-                if cmd_arg and cmd_arg.isdigit():
-                    idx = int(cmd_arg) - 1
-                    pending = load_pending_runs()
-                    if 0 <= idx < len(pending):
-                        job = pending.pop(idx)
-                        save_pending_runs(pending)
-                        send_telegram_message(
-                            f"Cancelled pending run {idx+1} (round={job.get('round') or 'default'}).")
-                    else:
-                        send_telegram_message(
-                            f"Invalid index. There are {len(pending)} pending jobs.")
-                else:
-                    send_telegram_message(
-                        "Usage: /cancel N  (where N is the job number from /pending)")
-
-            elif text and text.strip().lower() in ("/status", "status"):
-                if current_proc is not None and current_proc.poll() is None:
-                    send_telegram_message("Automation is currently running.")
-                else:
-                    send_telegram_message(
-                        "No automation is running right now.")
-
-            elif text and text.strip().lower() in ("/stop", "stop"):
-                if current_proc is not None and current_proc.poll() is None:
-                    current_proc.terminate()
-                    send_telegram_message(
-                        "Requested to stop the automation process.")
-                else:
-                    send_telegram_message(
-                        "No running automation process to stop.")
-
-            else:
-                # Default behavior: any message triggers start (optional). We'll treat any non-command as start.
-                if text:
-                    if current_proc is not None and current_proc.poll() is None:
-                        reply = "Automation is already running."
-                        print(reply)
-                        send_telegram_message(reply)
-                    else:
-                        reply = "Message received — starting automation now..."
-                        send_telegram_message(reply)
-                        try:
-                            current_proc = start_automation_subprocess()
-                            send_telegram_message(
-                                "Automation launched (background process).")
-                        except Exception as e:
-                            err = f"Failed to start automation: {e}"
-                            print(err)
-                            send_telegram_message(err)
+            handle_update(update)
 
         # Short sleep to avoid tight loop in case of errors
         time.sleep(1)
 
 
+def skip_backlog():
+    """Return the last pending update_id so messages sent before startup are ignored."""
+    # On startup, fetch any pending updates and advance the offset so we don't
+    # immediately process old messages that were sent before the listener started.
+    last_update_id = None
+    try:
+        pending = fetch_updates(timeout=1)
+        if pending:
+            last_update_id = pending[-1].get("update_id")
+            print(
+                f"Found {len(pending)} pending update(s). Ignoring backlog up to update_id {last_update_id}.")
+            print("If you want to process past messages instead, remove this startup-skip logic or run clear_updates.py first.")
+    except Exception as e:
+        print(f"Warning: failed to inspect pending updates on startup: {e}")
+        last_update_id = None
+    return last_update_id
+
+
 if __name__ == "__main__":
     main()
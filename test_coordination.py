@@ -0,0 +1,196 @@
+"""
+Tests for coordination.py (mutex, leases, claims). Run with:
+
+    uv run python -m pytest test_coordination.py
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+
+from coordination import FileLeaseStore, LeaseKeeper
+
+
+def _hold_mutex(root, name, log_path, rounds, stale_sec):
+    store = FileLeaseStore(root, mutex_stale_sec=stale_sec)
+    for _ in range(rounds):
+        with store.mutex(name, timeout=30):
+            with open(log_path, "a", encoding="utf-8") as fh:
+                fh.write(f"in {os.getpid()}\n")
+            time.sleep(0.002)
+            with open(log_path, "a", encoding="utf-8") as fh:
+                fh.write(f"out {os.getpid()}\n")
+
+
+def _assert_never_overlapped(log_path, expected_sections):
+    with open(log_path, encoding="utf-8") as fh:
+        lines = fh.read().split()[::2]  # "in"/"out" words
+    assert lines == ["in", "out"] * expected_sections
+
+
+def _claim(root, key, results):
+    results.put(FileLeaseStore(root).claim(key, f"worker-{os.getpid()}"))
+
+
+def test_mutex_excludes_other_processes(tmp_path):
+    log_path = tmp_path / "log"
+    procs = [multiprocessing.Process(target=_hold_mutex,
+                                     args=(str(tmp_path), "queue", str(log_path), 20, 30))
+             for _ in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+    _assert_never_overlapped(log_path, 4 * 20)
+
+
+def test_stale_mutex_is_broken_once(tmp_path):
+    store = FileLeaseStore(str(tmp_path), mutex_stale_sec=1)
+    lock = store._path("locks", "queue")
+    with open(lock, "w", encoding="utf-8") as fh:
+        fh.write("dead-instance")
+    old = time.time() - 60
+    os.utime(lock, (old, old))
+
+    # Several processes find the same stale lock at once; they must still take turns
+    log_path = tmp_path / "log"
+    procs = [multiprocessing.Process(target=_hold_mutex,
+                                     args=(str(tmp_path), "queue", str(log_path), 10, 1))
+             for _ in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+    _assert_never_overlapped(log_path, 4 * 10)
+    assert not [f for f in os.listdir(tmp_path / "locks") if f.endswith(".stale")]
+
+
+def test_stale_check_does_not_remove_a_lock_recreated_meanwhile(tmp_path, monkeypatch):
+    import coordination
+
+    store = FileLeaseStore(str(tmp_path), mutex_stale_sec=1)
+    lock = store._path("locks", "queue")
+    with open(lock, "w", encoding="utf-8") as fh:
+        fh.write("dead-instance")
+    old = time.time() - 60
+    os.utime(lock, (old, old))
+
+    real_getmtime = os.path.getmtime
+    calls = []
+
+    def getmtime(path):
+        mtime = real_getmtime(path)
+        if not calls:
+            # Right after we saw the stale lock, another process breaks it and takes
+            # the mutex itself
+            os.remove(lock)
+            with open(lock, "w", encoding="utf-8") as fh:
+                fh.write("other-instance")
+        calls.append(path)
+        return mtime
+
+    monkeypatch.setattr(coordination.os.path, "getmtime", getmtime)
+    try:
+        with store.mutex("queue", timeout=0.3):
+            raise AssertionError("took a mutex that another process holds")
+    except TimeoutError:
+        pass
+    with open(lock, encoding="utf-8") as fh:
+        assert fh.read() == "other-instance"
+
+
+def test_mutex_times_out_while_held(tmp_path):
+    store = FileLeaseStore(str(tmp_path))
+    with store.mutex("queue"):
+        started = time.monotonic()
+        try:
+            with store.mutex("queue", timeout=0.2):
+                raise AssertionError("mutex acquired twice")
+        except TimeoutError:
+            pass
+        assert time.monotonic() - started >= 0.2
+
+
+def test_release_keeps_a_lock_taken_over_by_someone_else(tmp_path):
+    store = FileLeaseStore(str(tmp_path))
+    lock = store._path("locks", "queue")
+    with store.mutex("queue"):
+        # Our lock was broken as stale and another instance took it
+        with open(lock, "w", encoding="utf-8") as fh:
+            fh.write("other-instance")
+    assert os.path.exists(lock)
+
+
+def test_lease_is_exclusive_until_ttl_expires(tmp_path):
+    store = FileLeaseStore(str(tmp_path))
+    assert store.acquire_lease("poller", "a", ttl=0.3)
+    assert not store.acquire_lease("poller", "b", ttl=0.3)
+    assert store.acquire_lease("poller", "a", ttl=0.3)  # renewal
+    assert store.lease_info("poller")["holder"] == "a"
+    time.sleep(0.4)
+    assert store.lease_info("poller") is None
+    assert store.acquire_lease("poller", "b", ttl=0.3)
+    assert not store.acquire_lease("poller", "a", ttl=0.3)
+
+
+def test_lease_keeper_hands_over_after_holder_stops_renewing(tmp_path):
+    store = FileLeaseStore(str(tmp_path))
+    first = LeaseKeeper(store, "poller", holder="a", ttl=0.6, renew_every=0.1).start()
+    assert first.wait_held(2)
+    second = LeaseKeeper(store, "poller", holder="b", ttl=0.6, renew_every=0.1).start()
+    time.sleep(0.3)
+    assert not second.held
+
+    # Simulate a crashed holder: stop renewing without releasing the lease
+    first._stop.set()
+    first._valid_until = 0.0
+    assert second.wait_held(3)
+    assert store.lease_info("poller")["holder"] == "b"
+    second.stop()
+
+
+def test_claim_has_a_single_winner(tmp_path):
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=_claim, args=(str(tmp_path), "job-1", results))
+             for _ in range(8)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(30)
+    outcomes = [results.get(timeout=5) for _ in procs]
+    assert outcomes.count(True) == 1
+
+
+def test_claim_can_be_released_and_taken_again(tmp_path):
+    store = FileLeaseStore(str(tmp_path))
+    assert store.claim("job-1", "a")
+    assert not store.claim("job-1", "b")
+    store.release_claim("job-1")
+    assert store.claim("job-1", "b")
+
+
+def test_claims_from_threads_have_a_single_winner(tmp_path):
+    store = FileLeaseStore(str(tmp_path))
+    wins = []
+    threads = [threading.Thread(target=lambda i=i: wins.append(store.claim("job-2", str(i))))
+               for i in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert wins.count(True) == 1
+
+
+def test_list_values_filters_by_prefix_and_age(tmp_path):
+    store = FileLeaseStore(str(tmp_path))
+    store.set_value("run-a", {"pid": 1})
+    store.set_value("run-b", {"pid": 2})
+    store.set_value("offset", 5)
+    assert sorted(v["pid"] for v in store.list_values("run-")) == [1, 2]
+    store.delete_value("run-a")
+    assert store.list_values("run-") == [{"pid": 2}]
+    time.sleep(0.05)
+    assert store.list_values("run-", max_age=0.01) == []
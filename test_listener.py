@@ -0,0 +1,238 @@
+"""
+Tests for telegram_listener.py command handling, without Telegram or a browser. Run with:
+
+    uv run python -m pytest test_listener.py
+"""
+
+import itertools
+import multiprocessing
+import os
+import time
+from collections import Counter
+from datetime import datetime, time as dt_time
+
+import pytest
+
+import telegram_listener
+from coordination import FileLeaseStore
+from rate_limit import TokenBucket
+
+
+class FakeProc:
+    """Stands in for the main.py Popen: running until `finish()` is called."""
+
+    _pids = itertools.count(10000)
+
+    def __init__(self, round_arg=None):
+        self.pid = next(self._pids)
+        self.round_arg = round_arg
+        self.started_at = "2024-01-01T09:30:00"
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def finish(self):
+        self.returncode = 0
+
+
+@pytest.fixture
+def replies():
+    """(chat_id, text) of every reply the listener queued."""
+    return []
+
+
+@pytest.fixture
+def listener(monkeypatch, tmp_path, replies):
+    """telegram_listener with fresh state, a fake booking process and captured replies."""
+    tl = telegram_listener
+    monkeypatch.setattr(tl, "send_ack",
+                        lambda text, chat_id=None: replies.append((chat_id, text)))
+    monkeypatch.setattr(tl, "send_telegram_message",
+                        lambda text, **kwargs: replies.append((None, text)))
+    monkeypatch.setattr(tl, "start_automation_subprocess", FakeProc)
+    monkeypatch.setattr(tl, "PENDING_RUNS_FILE", str(tmp_path / "pending_runs.json"))
+    monkeypatch.setattr(tl, "coord_store", FileLeaseStore(str(tmp_path / "coord")))
+    monkeypatch.setattr(tl, "current_proc", None)
+    monkeypatch.setattr(tl, "ALLOWED_CHAT_IDS", frozenset())
+    monkeypatch.setattr(tl, "command_stats", Counter())
+    monkeypatch.setattr(tl, "command_global_bucket", TokenBucket(1e6, 1e6))
+    monkeypatch.setattr(tl, "_chat_buckets", {})
+    monkeypatch.setattr(tl, "_throttled_chats", set())
+    monkeypatch.setattr(tl, "_recent_starts", {})
+    return tl
+
+
+def _slow_start(round_arg=None):
+    time.sleep(0.05)  # like Popen, leaves time for a racing instance to look
+    return FakeProc(round_arg)
+
+
+def _start_in_other_instance(root, results):
+    tl = telegram_listener
+    tl.coord_store = FileLeaseStore(root)
+    tl.INSTANCE_ID = f"worker:{os.getpid()}"
+    tl.start_automation_subprocess = _slow_start
+    proc, _ = tl.start_published_run("2")
+    results.put(proc is not None)
+
+
+def test_start_is_refused_while_another_instance_runs(listener, replies):
+    listener.coord_store.set_value(listener.RUN_RECORD_PREFIX + "worker:1", {
+        "instance": "worker:1", "pid": 4242, "round": "2", "started_at": None})
+
+    assert not listener._start_now("chat", "2", ("starting", "launched"))
+    assert listener.current_proc is None
+    assert replies == [(None, "Automation is already running on worker:1.")]
+
+
+def test_started_run_is_published_at_once(listener):
+    assert listener._start_now("chat", "2", ("starting", "launched"))
+    record = listener.coord_store.get_value(
+        listener.RUN_RECORD_PREFIX + listener.INSTANCE_ID)
+    assert record["pid"] == listener.current_proc.pid
+
+
+def test_only_one_instance_starts_at_a_time(tmp_path):
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=_start_in_other_instance,
+                                     args=(str(tmp_path), results))
+             for _ in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+    assert sorted(results.get(timeout=5) for _ in procs) == [False, False, False, True]
+
+
+def _after_schedule():
+    return datetime.combine(datetime.now().date(), dt_time(23, 59))
+
+
+def test_watcher_does_not_rebook_a_round_started_by_command(listener):
+    assert listener._start_now("chat", None, ("starting", "launched"))  # default round 2
+    started = listener.current_proc
+
+    assert listener.launch_for_available_slot("2", {})  # handled: no retry
+    assert listener.current_proc is started
+
+
+def test_queued_job_is_skipped_after_the_watcher_booked_its_round(listener, replies):
+    listener.schedule_run("chat", "2")
+    assert listener.launch_for_available_slot("2", {})
+    booked = listener.current_proc
+    booked.finish()
+
+    listener.process_pending_runs_once(now=_after_schedule())
+    assert listener.current_proc is booked
+    assert listener.load_pending_runs() == []
+    assert "already started today" in replies[-1][1]
+
+
+def test_watcher_retries_while_another_round_runs(listener):
+    assert listener._start_now("chat", "1", ("starting", "launched"))
+    other_round = listener.current_proc
+
+    assert not listener.launch_for_available_slot("2", {})
+    other_round.finish()
+    assert listener.launch_for_available_slot("2", {})  # the slot was given back
+    assert listener.current_proc is not other_round
+
+
+def _send(tl, chat_id, text):
+    tl.handle_update({"update_id": 1, "message": {"chat": {"id": chat_id}, "text": text}})
+
+
+def test_commands_beyond_the_chat_burst_are_dropped(listener, replies, monkeypatch):
+    monkeypatch.setattr(listener, "COMMAND_CHAT_RATE", 0.001)
+    monkeypatch.setattr(listener, "COMMAND_CHAT_BURST", 2)
+    for _ in range(5):
+        _send(listener, 1, "/pending")
+    _send(listener, 2, "/pending")  # another chat has its own budget
+
+    assert listener.command_stats["handled"] == 3
+    assert listener.command_stats["dropped_chat"] == 3
+    # Told once for the whole burst, and only the chat that sent it
+    assert [r for r in replies if r[1].startswith("Too many")] == [
+        ("1", "Too many commands; ignoring them for a few seconds.")]
+
+
+def test_slow_down_notice_is_sent_again_after_an_admitted_command(listener, replies, monkeypatch):
+    monkeypatch.setattr(listener, "COMMAND_CHAT_RATE", 0.001)
+    monkeypatch.setattr(listener, "COMMAND_CHAT_BURST", 1)
+    _send(listener, 1, "/pending")
+    _send(listener, 1, "/pending")
+    listener._chat_buckets["1"][0] = TokenBucket(0.001, 1)  # refilled
+    _send(listener, 1, "/pending")
+    _send(listener, 1, "/pending")
+
+    assert sum(r[1].startswith("Too many") for r in replies) == 2
+
+
+def test_global_budget_drops_without_telling_anyone(listener, replies, monkeypatch):
+    monkeypatch.setattr(listener, "command_global_bucket", TokenBucket(0.001, 1))
+    _send(listener, 1, "/pending")
+    _send(listener, 2, "/pending")
+
+    assert listener.command_stats["dropped_global"] == 1
+    assert not any(r[1].startswith("Too many") for r in replies)
+
+
+def test_stop_is_never_throttled(listener, monkeypatch):
+    monkeypatch.setattr(listener, "command_global_bucket", TokenBucket(0.001, 1))
+    _send(listener, 1, "/pending")
+    _send(listener, 1, "/stop")
+
+    assert listener.command_stats["handled"] == 2
+
+
+def test_chat_budgets_are_capped(listener, monkeypatch):
+    monkeypatch.setattr(listener, "MAX_TRACKED_CHATS", 3)
+    for chat_id in ("a", "b", "c"):
+        assert listener._admit(chat_id)
+    listener._chat_buckets["a"][1] -= 60  # idle long enough for its bucket to refill
+    listener._throttled_chats.add("a")
+
+    assert listener._admit("d")
+    assert sorted(listener._chat_buckets) == ["b", "c", "d"]  # only the idle one forgotten
+    assert "a" not in listener._throttled_chats
+
+    assert listener._admit("e")  # none idle: start over rather than grow
+    assert sorted(listener._chat_buckets) == ["e"]
+
+
+def test_duplicate_start_is_merged_only_while_the_run_is_live(listener, replies, monkeypatch):
+    monkeypatch.setattr(listener, "SCHEDULE_HOUR", 0)
+    monkeypatch.setattr(listener, "SCHEDULE_MINUTE", 0)  # every /start runs at once
+    _send(listener, 1, "/start 2")
+    first = listener.current_proc
+    _send(listener, 2, "/start 2")
+
+    assert listener.current_proc is first
+    assert listener.command_stats["merged"] == 1
+    assert replies[-1][0] == "2" and replies[-1][1].startswith("Same request received")
+
+    first.finish()
+    _send(listener, 2, "/start 2")
+    assert listener.current_proc is not first
+    assert listener.command_stats["merged"] == 1
+
+
+class _Morning(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return datetime.combine(datetime.today(), dt_time(8, 0))
+
+
+def test_duplicate_queued_start_is_merged_only_while_the_job_is_queued(listener, monkeypatch):
+    monkeypatch.setattr(listener, "datetime", _Morning)  # before the scheduled time
+    _send(listener, 1, "/start 2")
+    _send(listener, 1, "/start 2")
+    assert len(listener.load_pending_runs()) == 1
+    assert listener.command_stats["merged"] == 1
+
+    _send(listener, 1, "/cancel 1")
+    _send(listener, 1, "/start 2")
+    assert len(listener.load_pending_runs()) == 1
+    assert listener.command_stats["merged"] == 1
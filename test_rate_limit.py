@@ -0,0 +1,82 @@
+"""
+Tests for rate_limit.py (token bucket). Run with:
+
+    uv run python -m pytest test_rate_limit.py
+"""
+
+import pytest
+
+from rate_limit import TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_starts_full_and_refuses_when_empty():
+    clock = FakeClock()
+    bucket = TokenBucket(1, 3, clock=clock)
+
+    assert [bucket.try_take() for _ in range(4)] == [True, True, True, False]
+
+
+def test_refills_at_the_rate_up_to_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(2, 3, clock=clock)
+    for _ in range(3):
+        bucket.try_take()
+
+    clock.now += 0.5  # one token back
+    assert bucket.try_take()
+    assert not bucket.try_take()
+
+    clock.now += 60  # long idle: still only `capacity` tokens
+    assert sum(bucket.try_take() for _ in range(10)) == 3
+
+
+def test_delay_until_the_next_token():
+    clock = FakeClock()
+    bucket = TokenBucket(4, 1, clock=clock)
+
+    assert bucket.delay() == 0.0
+    bucket.try_take()
+    assert bucket.delay() == pytest.approx(0.25)
+    clock.now += 0.1
+    assert bucket.delay() == pytest.approx(0.15)
+
+
+def test_block_empties_and_refuses_until_it_expires():
+    clock = FakeClock()
+    bucket = TokenBucket(10, 5, clock=clock)
+    bucket.block(3)
+
+    assert bucket.delay() == pytest.approx(3)
+    clock.now += 2.9  # refilled by now, but still blocked
+    assert not bucket.try_take()
+    clock.now += 0.1
+    assert bucket.try_take()
+
+
+def test_shorter_block_does_not_shorten_a_longer_one():
+    clock = FakeClock()
+    bucket = TokenBucket(10, 5, clock=clock)
+    bucket.block(5)
+    bucket.block(1)
+
+    clock.now += 2
+    assert not bucket.try_take()
+
+
+def test_default_capacity_is_one_second_of_tokens():
+    assert TokenBucket(25).capacity == 25
+    assert TokenBucket(0.5).capacity == 1
+
+
+@pytest.mark.parametrize("rate", [0, -1])
+def test_rate_must_be_positive(rate):
+    with pytest.raises(ValueError):
+        TokenBucket(rate)
@@ -0,0 +1,139 @@
+"""
+Tests for the TelegramDispatcher in telegram_helper.py, against a fake Bot API session.
+Run with:
+
+    uv run python -m pytest test_telegram_helper.py
+"""
+
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+import telegram_helper
+from telegram_helper import (PRIORITY_ACK, PRIORITY_ALERT, PRIORITY_STATUS,
+                             TelegramDispatcher)
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self._body = body if body is not None else {"ok": status_code == 200}
+        self.text = str(self._body)
+
+    def json(self):
+        return self._body
+
+
+class FakeBotAPI:
+    """
+    Stands in for requests.Session in the sender threads. Answers with the queued
+    `responses` (a FakeResponse, or an exception to raise) and then with 200s.
+    """
+
+    def __init__(self):
+        self.responses = []
+        self.sent = []  # (chat_id, text) of every request, in order
+        self.in_flight = Counter()
+        self.max_in_flight = Counter()
+        self.gate = threading.Event()
+        self.gate.set()
+        self._lock = threading.Lock()
+
+    def post(self, url, json=None, timeout=None):
+        chat_id = json["chat_id"]
+        with self._lock:
+            self.in_flight[chat_id] += 1
+            self.max_in_flight[chat_id] = max(self.max_in_flight[chat_id],
+                                              self.in_flight[chat_id])
+        try:
+            self.gate.wait(10)
+            with self._lock:
+                self.sent.append((chat_id, json["text"]))
+                response = self.responses.pop(0) if self.responses else FakeResponse(200)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        finally:
+            with self._lock:
+                self.in_flight[chat_id] -= 1
+
+    def wait_in_flight(self, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        while sum(self.in_flight.values()) < count:
+            assert time.monotonic() < deadline, "sender threads did not pick up the messages"
+            time.sleep(0.001)
+
+
+@pytest.fixture
+def api(monkeypatch):
+    api = FakeBotAPI()
+    monkeypatch.setattr(telegram_helper.requests, "Session", lambda: api)
+    return api
+
+
+def _dispatcher(workers=1):
+    # Limits lifted: these tests are about ordering and failures, not pacing
+    return TelegramDispatcher("http://bot.invalid/sendMessage", global_rate=1e6,
+                              global_burst=1e6, chat_rate=1e6, workers=workers)
+
+
+def test_higher_priority_goes_first_within_a_chat(api):
+    api.gate.clear()
+    dispatcher = _dispatcher()
+    dispatcher.submit(["1"], "in flight", PRIORITY_ACK)
+    api.wait_in_flight(1)
+    dispatcher.submit(["1"], "ack 1", PRIORITY_ACK)
+    dispatcher.submit(["1"], "status", PRIORITY_STATUS)
+    dispatcher.submit(["1"], "ack 2", PRIORITY_ACK)
+    dispatcher.submit(["1"], "alert", PRIORITY_ALERT)
+    api.gate.set()
+
+    assert dispatcher.flush(5)
+    assert [text for _, text in api.sent] == ["in flight", "alert", "status", "ack 1", "ack 2"]
+
+
+def test_one_request_in_flight_per_chat(api):
+    api.gate.clear()
+    dispatcher = _dispatcher(workers=4)
+    dispatcher.submit(["1"], "a")
+    dispatcher.submit(["1"], "b")
+    dispatcher.submit(["1", "2"], "c")
+    api.wait_in_flight(2)  # one per chat; chat 1 does not hold up chat 2
+    time.sleep(0.05)
+    assert sum(api.in_flight.values()) == 2
+    api.gate.set()
+
+    assert dispatcher.flush(5)
+    assert api.max_in_flight == {"1": 1, "2": 1}
+    assert sorted(api.sent) == [("1", "a"), ("1", "b"), ("1", "c"), ("2", "c")]
+
+
+def test_rate_limited_message_is_retried_despite_a_malformed_body(api):
+    api.responses.append(FakeResponse(429, {"ok": False, "parameters": None}))
+    dispatcher = _dispatcher()
+
+    assert dispatcher.submit(["1"], "hello").wait(5)  # retried after the default 1 s
+    assert api.sent == [("1", "hello"), ("1", "hello")]
+    assert dispatcher.stats()["rate_limited"] == 1
+
+
+def test_unexpected_error_fails_the_message_but_not_the_sender(api):
+    api.responses.append(RuntimeError("boom"))
+    dispatcher = _dispatcher()  # one sender thread: it must survive
+
+    assert not dispatcher.submit(["1"], "lost").wait(5)
+    assert dispatcher.submit(["1"], "next").wait(5)
+    stats = dispatcher.stats()
+    assert (stats["sent"], stats["failed"]) == (1, 1)
+
+
+def test_flush_times_out_while_a_send_is_stuck(api):
+    api.gate.clear()
+    dispatcher = _dispatcher()
+    dispatcher.submit(["1"], "stuck")
+
+    assert not dispatcher.flush(0.05)
+    api.gate.set()
+    assert dispatcher.flush(5)